@@ -0,0 +1,67 @@
+"""
+Асинхронный путь чтения для ASGI.
+
+В Django 3.2 синхронные вьюхи под ASGI выполняются в одном общем потоке
+(thread_sensitive), поэтому медленный запрос к базе данных задерживает
+все остальные запросы процесса. Горячие вьюхи чтения оборачиваются в
+асинхронные: GET и HEAD выполняются в ограниченном пуле потоков
+(ASYNC_READ_THREADS), остальные методы - как раньше, в общем потоке.
+Асинхронного ORM в Django 3.2 нет, поэтому запросы к базе данных
+выполняются в потоках пула; у каждого потока свое соединение, устаревшие
+соединения закрываются до и после запроса, как это делают сигналы
+запроса для общего потока.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from .metrics import render_response
+from .signals import check_database_connections
+
+READ_METHODS = ('GET', 'HEAD')
+ASYNC_READ_ROUTES = (
+    'recipes-list',
+    'recipes-detail',
+    'ingredients-list',
+    'tags-list',
+)
+
+read_executor = ThreadPoolExecutor(
+    max_workers=settings.ASYNC_READ_THREADS,
+    thread_name_prefix='api-read',
+)
+
+
+def run_read_view(view, request, *args, **kwargs):
+    close_old_connections()
+    check_database_connections()
+    try:
+        return render_response(view(request, *args, **kwargs))
+    finally:
+        close_old_connections()
+
+
+def as_async_read_view(view):
+    """Оборачивает синхронную вьюху в асинхронную."""
+    read_view = sync_to_async(
+        run_read_view, thread_sensitive=False, executor=read_executor)
+    write_view = sync_to_async(view)
+
+    @wraps(view)
+    async def async_view(request, *args, **kwargs):
+        if request.method in READ_METHODS:
+            return await read_view(view, request, *args, **kwargs)
+        return await write_view(request, *args, **kwargs)
+
+    return async_view
+
+
+def get_async_read_urls(urls):
+    """Заменяет вьюхи горячих маршрутов чтения асинхронными."""
+    for pattern in urls:
+        if getattr(pattern, 'name', None) in ASYNC_READ_ROUTES:
+            pattern.callback = as_async_read_view(pattern.callback)
+    return urls
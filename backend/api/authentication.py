@@ -0,0 +1,150 @@
+"""
+Аутентификация по токену с кэшированием пользователя.
+
+Пользователь токена ищется сначала в LRU-кэше процесса, затем в общем
+кэше (если он задан настройкой TOKEN_CACHE_ALIAS и действительно общий
+для процессов) и только потом в базе данных. В кэше хранятся только поля
+CACHED_USER_FIELDS, без хеша пароля; по ним строится пользователь с
+отложенными остальными полями. Записи сбрасываются при удалении токена
+(выход из системы), изменении и удалении пользователя (смена пароля,
+деактивация). Сброс доходит до общего кэша и кэша текущего процесса; в
+остальных процессах запись живет не дольше TOKEN_LOCAL_CACHE_TIMEOUT
+секунд.
+"""
+import hashlib
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+User = get_user_model()
+
+CACHED_USER_FIELDS = tuple(
+    field.attname for field in User._meta.concrete_fields
+    if field.attname in {
+        'id', 'email', 'username', 'first_name', 'last_name',
+        'is_active', 'is_staff', 'is_superuser',
+    }
+)
+PROCESS_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+class LocalTokenCache:
+    """Ограниченный по размеру и времени жизни LRU-кэш процесса."""
+
+    def __init__(self, maxsize, timeout):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._lock = Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            values, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return values
+
+    def set(self, key, values):
+        if not self.maxsize or not self.timeout:
+            return
+        with self._lock:
+            self._entries[key] = (values, time.monotonic() + self.timeout)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+local_token_cache = LocalTokenCache(
+    settings.TOKEN_LOCAL_CACHE_SIZE, settings.TOKEN_LOCAL_CACHE_TIMEOUT)
+
+
+def get_token_cache_key(key):
+    """Ключ кэша хранит хеш токена, а не сам токен."""
+    return f'token:{hashlib.sha1(key.encode()).hexdigest()}'
+
+
+def get_shared_cache():
+    """
+    Возвращает общий для процессов кэш токенов.
+
+    Кэш в памяти процесса общим не считается: сброс записи не дошел бы до
+    других процессов, и отозванный токен принимался бы ими до истечения
+    TOKEN_CACHE_TIMEOUT.
+    """
+    alias = settings.TOKEN_CACHE_ALIAS
+    if not alias or (
+            settings.CACHES[alias]['BACKEND'] in PROCESS_CACHE_BACKENDS):
+        return None
+    return caches[alias]
+
+
+def invalidate_tokens(keys):
+    """Сбрасывает закэшированные токены."""
+    cache_keys = [get_token_cache_key(key) for key in keys]
+    for cache_key in cache_keys:
+        local_token_cache.delete(cache_key)
+    shared_cache = get_shared_cache()
+    if shared_cache is not None and cache_keys:
+        shared_cache.delete_many(cache_keys)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Аутентификация по токену без запроса к базе данных на каждый запрос.
+
+    Для каждого запроса из закэшированных полей строится новый
+    пользователь, поэтому изменения request.user в одном запросе не
+    попадают в другие. Остальные поля пользователя загружаются из базы
+    данных при первом обращении, а save() сохраняет только загруженные
+    поля.
+    """
+
+    def get_user_values(self, key):
+        cache_key = get_token_cache_key(key)
+        values = local_token_cache.get(cache_key)
+        if values is not None:
+            return values
+        shared_cache = get_shared_cache()
+        if shared_cache is not None:
+            values = shared_cache.get(cache_key)
+        if values is None:
+            model = self.get_model()
+            try:
+                values = model.objects.filter(key=key).values_list(
+                    *(f'user__{field}' for field in CACHED_USER_FIELDS)
+                ).get()
+            except model.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            if shared_cache is not None:
+                shared_cache.set(
+                    cache_key, values, settings.TOKEN_CACHE_TIMEOUT)
+        local_token_cache.set(cache_key, values)
+        return values
+
+    def authenticate_credentials(self, key):
+        user = User.from_db(
+            DEFAULT_DB_ALIAS, CACHED_USER_FIELDS, self.get_user_values(key))
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.'))
+        return user, self.get_model()(key=key, user=user)
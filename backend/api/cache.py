@@ -0,0 +1,123 @@
+"""
+Версионированный кэш ответов API.
+
+Ключи кэша содержат метку версии пространства имен (теги, ингредиенты,
+рецепты, журнал изменений индекса подбора рецептов),
+поэтому для сброса кэша достаточно заменить метку: устаревшие записи
+перестают находиться и со временем вытесняются.
+"""
+import hashlib
+from functools import partial
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import patch_vary_headers
+from rest_framework import status
+from rest_framework.response import Response
+
+TAGS = 'tags'
+INGREDIENTS = 'ingredients'
+RECIPES = 'recipes'
+COOKABLE = 'cookable'
+RESPONSE_CACHE_TIMEOUT = 24 * 60 * 60
+COUNTER_CACHE_TIMEOUT = 60
+
+
+def get_version(*namespaces):
+    """Возвращает метку версии для набора пространств имен."""
+    keys = [f'{namespace}_version' for namespace in namespaces]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            versions[key] = cache.get_or_set(
+                key, lambda: uuid4().hex, timeout=None)
+    return '.'.join(versions[key] for key in keys)
+
+
+def bump_version(namespace):
+    """
+    Помечает кэш пространства имен устаревшим во всех процессах.
+
+    Метка заменяется после фиксации текущей транзакции, чтобы
+    параллельный запрос не закэшировал незафиксированное состояние под
+    новой версией.
+    """
+    transaction.on_commit(lambda: cache.set(
+        f'{namespace}_version', uuid4().hex, timeout=None))
+
+
+def get_cache_key(namespace, version, path):
+    """
+    Возвращает ключ кэша ответа.
+
+    Версия и адрес запроса хешируются: адреса с поисковыми запросами
+    и фильтрами превышают допустимую для memcached длину ключа.
+    """
+    digest = hashlib.sha1(f'{version}:{path}'.encode()).hexdigest()
+    return f'{namespace}:{digest}'
+
+
+def get_recipe_feed_key(request):
+    """
+    Возвращает ключ кэша страницы ленты рецептов.
+
+    Ключ учитывает версии рецептов, тегов и ингредиентов, а также полный
+    адрес запроса: ссылки пагинации в ответе абсолютные.
+    """
+    version = get_version(RECIPES, TAGS, INGREDIENTS)
+    return get_cache_key(RECIPES, version, request.build_absolute_uri())
+
+
+def get_etag(*parts):
+    digest = hashlib.sha1(':'.join(parts).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def etag_matches(request, etag):
+    if_none_match = request.headers.get('If-None-Match', '')
+    return etag in (
+        value.strip() for value in if_none_match.split(',')
+    ) or if_none_match.strip() == '*'
+
+
+class CachedReferenceMixin:
+    """
+    Кэширование ответов вьюсетов справочников.
+
+    Данные ответа хранятся в кэше под ключом из версии справочника и пути
+    запроса. Ответ снабжается строгим ETag; если он совпадает с
+    If-None-Match, возвращается 304 без обращения к базе данных.
+    """
+
+    cache_namespace = None
+
+    def get_cached_response(self, request, get_response):
+        version = get_version(self.cache_namespace)
+        path = request.get_full_path()
+        etag = get_etag(
+            self.cache_namespace, version, path,
+            request.accepted_renderer.media_type)
+        if etag_matches(request, etag):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            key = get_cache_key(self.cache_namespace, version, path)
+            data = cache.get(key)
+            if data is None:
+                response = get_response()
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                cache.set(key, response.data, RESPONSE_CACHE_TIMEOUT)
+            else:
+                response = Response(data)
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Accept',))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            request, partial(super().list, request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            request, partial(super().retrieve, request, *args, **kwargs))
@@ -0,0 +1,203 @@
+"""
+Обратный индекс «ингредиент -> рецепты» для подбора рецептов по продуктам.
+
+Для каждого ингредиента хранится отсортированный массив id рецептов
+(array('I')), для каждого рецепта - массив id его ингредиентов. Покрытие
+рецептов набором продуктов считается подсчетом вхождений по массивам
+выбранных ингредиентов, без обращения к базе данных.
+
+Индекс строится целиком один раз, дальше обновляется по журналу
+изменений в общем кэше: сигналы после фиксации транзакции записывают в
+журнал id рецептов, у которых изменились ингредиенты, и каждый процесс
+перечитывает ингредиенты только этих рецептов. Обновление создает новый
+снимок индекса, поэтому запрос, начавший работу со снимком, не видит
+половины изменений. Индекс строится заново, если процесс отстал больше
+чем на MAX_CHANGES записей журнала или часть журнала вытеснена из кэша.
+"""
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter
+from threading import Lock
+
+from django.core.cache import cache
+from django.db import transaction
+from recipes.models import RecipeIngredient
+
+from .cache import COOKABLE, bump_version, get_version
+
+MAX_CHANGES = 1000
+CHANGES_TIMEOUT = 24 * 60 * 60
+
+
+def get_changes_key(version, number=None):
+    if number is None:
+        return f'{COOKABLE}_changes:{version}'
+    return f'{COOKABLE}_change:{version}:{number}'
+
+
+def append_changes(recipe_ids):
+    """Добавляет в журнал изменений id рецептов."""
+    version = get_version(COOKABLE)
+    key = get_changes_key(version)
+    cache.add(key, 0, timeout=None)
+    try:
+        number = cache.incr(key)
+    except ValueError:
+        bump_version(COOKABLE)
+        return
+    cache.set(
+        get_changes_key(version, number), recipe_ids, CHANGES_TIMEOUT)
+
+
+def record_changes(recipe_ids):
+    """
+    Отмечает, что у рецептов изменились ингредиенты.
+
+    Запись в журнал делается после фиксации транзакции, чтобы процессы
+    прочитали уже зафиксированные ингредиенты.
+    """
+    recipe_ids = list(recipe_ids)
+    if recipe_ids:
+        transaction.on_commit(lambda: append_changes(recipe_ids))
+
+
+class CookableSnapshot:
+    """Неизменяемый снимок обратного индекса."""
+
+    def __init__(self, postings, recipe_ingredients):
+        self.postings = postings
+        self.recipe_ingredients = recipe_ingredients
+
+    @classmethod
+    def build(cls):
+        postings = {}
+        recipe_ingredients = {}
+        rows = RecipeIngredient.objects.order_by(
+            'ingredients_id', 'recipe_id'
+        ).values_list('ingredients_id', 'recipe_id')
+        for ingredient_id, recipe_id in rows.iterator():
+            postings.setdefault(ingredient_id, array('I')).append(recipe_id)
+            recipe_ingredients.setdefault(
+                recipe_id, array('I')).append(ingredient_id)
+        return cls(postings, recipe_ingredients)
+
+    def update(self, recipe_ids):
+        """
+        Возвращает снимок с перечитанными ингредиентами рецептов.
+
+        Копируются только словари и массивы затронутых ингредиентов.
+        """
+        ingredients = {recipe_id: [] for recipe_id in recipe_ids}
+        rows = RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids
+        ).order_by('ingredients_id').values_list('recipe_id', 'ingredients_id')
+        for recipe_id, ingredient_id in rows:
+            ingredients[recipe_id].append(ingredient_id)
+        postings = dict(self.postings)
+        recipe_ingredients = dict(self.recipe_ingredients)
+        copied = set()
+
+        def get_posting(ingredient_id):
+            if ingredient_id not in copied:
+                postings[ingredient_id] = array(
+                    'I', postings.get(ingredient_id, ()))
+                copied.add(ingredient_id)
+            return postings[ingredient_id]
+
+        for recipe_id, ingredient_ids in ingredients.items():
+            for ingredient_id in recipe_ingredients.pop(recipe_id, ()):
+                posting = get_posting(ingredient_id)
+                position = bisect_left(posting, recipe_id)
+                if position < len(posting) and posting[position] == recipe_id:
+                    del posting[position]
+            if ingredient_ids:
+                recipe_ingredients[recipe_id] = array('I', ingredient_ids)
+            for ingredient_id in ingredient_ids:
+                insort(get_posting(ingredient_id), recipe_id)
+        for ingredient_id in copied:
+            if not postings[ingredient_id]:
+                del postings[ingredient_id]
+        return CookableSnapshot(postings, recipe_ingredients)
+
+    def match(self, ingredient_ids, max_missing=None):
+        """
+        Подбирает рецепты, в которые входит хотя бы один из ингредиентов.
+
+        Возвращает список кортежей (recipe_id, число имеющихся
+        ингредиентов, всего ингредиентов), упорядоченный по числу
+        недостающих ингредиентов, затем по числу имеющихся (по убыванию)
+        и по id (сначала новые).
+        """
+        coverage = Counter()
+        for ingredient_id in set(ingredient_ids):
+            coverage.update(self.postings.get(ingredient_id, ()))
+        results = []
+        for recipe_id, matched in coverage.items():
+            total = len(self.recipe_ingredients[recipe_id])
+            if max_missing is not None and total - matched > max_missing:
+                continue
+            results.append((recipe_id, matched, total))
+        results.sort(key=lambda result: (
+            result[2] - result[1], -result[1], -result[0]))
+        return results
+
+    def get_missing(self, recipe_ids, ingredient_ids):
+        """Возвращает {recipe_id: [id недостающих ингредиентов]}."""
+        available = set(ingredient_ids)
+        return {
+            recipe_id: [
+                ingredient_id
+                for ingredient_id in self.recipe_ingredients.get(
+                    recipe_id, ())
+                if ingredient_id not in available
+            ]
+            for recipe_id in recipe_ids
+        }
+
+
+class CookableIndex:
+    """Обратный индекс ингредиентов рецептов в памяти процесса."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._version = None
+        self._number = 0
+        self._snapshot = CookableSnapshot({}, {})
+
+    def _get_head(self):
+        version = get_version(COOKABLE)
+        return version, cache.get(get_changes_key(version), 0)
+
+    def _get_changed_recipes(self, version, number):
+        if version != self._version or number - self._number > MAX_CHANGES:
+            return None
+        keys = [
+            get_changes_key(version, change)
+            for change in range(self._number + 1, number + 1)
+        ]
+        changes = cache.get_many(keys)
+        if len(changes) < len(keys):
+            return None
+        return {
+            recipe_id
+            for recipe_ids in changes.values()
+            for recipe_id in recipe_ids
+        }
+
+    def snapshot(self):
+        """Возвращает актуальный снимок индекса."""
+        version, number = self._get_head()
+        if (version, number) == (self._version, self._number):
+            return self._snapshot
+        with self._lock:
+            if (version, number) != (self._version, self._number):
+                recipe_ids = self._get_changed_recipes(version, number)
+                if recipe_ids is None:
+                    self._snapshot = CookableSnapshot.build()
+                elif recipe_ids:
+                    self._snapshot = self._snapshot.update(recipe_ids)
+                self._version, self._number = version, number
+            return self._snapshot
+
+
+cookable_index = CookableIndex()
@@ -1,12 +1,23 @@
+from django.db.models import Exists, OuterRef
 from django_filters.rest_framework import FilterSet, filters
 from recipes.models import Recipe, Tag
-from rest_framework.filters import SearchFilter
+from recipes.search import search
+from rest_framework.filters import BaseFilterBackend, OrderingFilter
 
+SEARCH_PARAM = 'search'
+COUNTER_ORDERING_FIELDS = ('favorites_count', 'cart_count')
+TAGS_MODE_ANY = 'any'
+TAGS_MODE_ALL = 'all'
+TAGS_MODES = (
+    (TAGS_MODE_ANY, 'Любой из тегов'),
+    (TAGS_MODE_ALL, 'Все теги'),
+)
 
-class IngredientSearchFilter(SearchFilter):
-    """Фильтр поиска для ингредиентов по названию."""
 
-    search_param = 'name'
+def get_search_query(request):
+    if request is None:
+        return ''
+    return request.query_params.get(SEARCH_PARAM, '').strip()
 
 
 class RecipeFilter(FilterSet):
@@ -15,15 +26,22 @@ class RecipeFilter(FilterSet):
 
     Ключевые параметры:
     tags - позволяет фильтровать рецепты по слагам тегов
+    tags_mode - any (хотя бы один из тегов, по умолчанию) или all (все теги)
     is_favorited - нахождение рецепта в избранном
     is_in_shopping_cart - в корзине покупок.
+
+    Теги проверяются подзапросами EXISTS по индексу (tag_id, recipe_id),
+    поэтому рецепт попадает в выдачу один раз без DISTINCT.
     """
 
     tags = filters.ModelMultipleChoiceFilter(
         field_name='tags__slug',
         to_field_name='slug',
         queryset=Tag.objects.all(),
+        method='filter_tags',
     )
+    tags_mode = filters.ChoiceFilter(
+        choices=TAGS_MODES, method='filter_tags_mode')
     is_favorited = filters.BooleanFilter(method='filter_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart'
@@ -33,11 +51,27 @@ class RecipeFilter(FilterSet):
         model = Recipe
         fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart')
 
+    def filter_tags(self, queryset, name, tags):
+        if not tags:
+            return queryset
+        recipe_tags = Recipe.tags.through.objects.filter(
+            recipe_id=OuterRef('pk'))
+        if self.form.cleaned_data.get('tags_mode') == TAGS_MODE_ALL:
+            for tag in tags:
+                queryset = queryset.filter(
+                    Exists(recipe_tags.filter(tag_id=tag.id)))
+            return queryset
+        return queryset.filter(Exists(recipe_tags.filter(
+            tag_id__in=[tag.id for tag in tags])))
+
+    def filter_tags_mode(self, queryset, name, tags_mode):
+        return queryset
+
     def filter_is_favorited(self, queryset, name, is_favorited_value):
         if not self.request.user.is_authenticated:
             return queryset
         if is_favorited_value:
-            return queryset.filter(favorites__user=self.request.user)
+            return queryset.filter(is_favorited=True)
         return queryset
 
     def filter_is_in_shopping_cart(
@@ -45,5 +79,39 @@ class RecipeFilter(FilterSet):
         if not self.request.user.is_authenticated:
             return queryset
         if is_in_shopping_cart_value:
-            return queryset.filter(shopping_cart__user=self.request.user)
+            return queryset.filter(is_in_shopping_cart=True)
         return queryset
+
+
+class RecipeSearchFilter(BaseFilterBackend):
+    """
+    Полнотекстовый поиск рецептов по параметру search.
+
+    Ищет по названию, описанию и названиям ингредиентов и сортирует
+    результаты по релевантности.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = get_search_query(request)
+        if not query:
+            return queryset
+        return search(queryset, query)
+
+
+class RecipeOrderingFilter(OrderingFilter):
+    """
+    Сортировка рецептов по параметру ordering.
+
+    К выбранным полям добавляется стандартная сортировка рецептов, чтобы
+    порядок был однозначным и годился для пагинации по курсору.
+    """
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if not ordering:
+            return ordering
+        names = {field.lstrip('-') for field in ordering}
+        return (*ordering, *(
+            field for field in Recipe._meta.ordering
+            if field.lstrip('-') not in names
+        ))
@@ -0,0 +1,80 @@
+"""
+Индекс ингредиентов в памяти процесса для автодополнения.
+
+Индекс хранит отсортированный по названию массив ингредиентов и отвечает
+на поиск по префиксу бинарным поиском, не обращаясь к базе данных.
+Актуальность индекса определяется меткой версии в кэше: при изменении
+ингредиентов метка заменяется и индекс перестраивается при следующем
+обращении.
+"""
+from bisect import bisect_left
+from threading import Lock
+
+from recipes.models import Ingredient
+
+from .cache import INGREDIENTS, bump_version, get_version
+
+MAX_SEARCH_RESULTS = 30
+
+
+class IngredientIndex:
+    """Отсортированный массив ингредиентов с поиском по префиксу."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._version = None
+        self._index = ([], [])
+
+    def _build(self):
+        ingredients = Ingredient.objects.values(
+            'id', 'name', 'measurement_unit')
+        rows = sorted(
+            ingredients, key=lambda row: (row['name'].lower(), row['id']))
+        return [row['name'].lower() for row in rows], rows
+
+    def _ensure_fresh(self):
+        version = get_version(INGREDIENTS)
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            self._index = self._build()
+            self._version = version
+
+    def all(self):
+        """Возвращает все ингредиенты в алфавитном порядке."""
+        self._ensure_fresh()
+        return list(self._index[1])
+
+    def search(self, query, limit=MAX_SEARCH_RESULTS):
+        """
+        Ищет ингредиенты по названию.
+
+        Сначала возвращаются совпадения по началу названия, затем
+        совпадения по вхождению подстроки; всего не более limit записей.
+        """
+        self._ensure_fresh()
+        query = query.strip().lower()
+        keys, rows = self._index
+        start = bisect_left(keys, query)
+        end = start
+        while end < len(keys) and end - start < limit and (
+                keys[end].startswith(query)):
+            end += 1
+        results = rows[start:end]
+        if len(results) < limit:
+            for key, row in zip(keys, rows):
+                if query in key and not key.startswith(query):
+                    results.append(row)
+                    if len(results) == limit:
+                        break
+        return results
+
+    @staticmethod
+    def invalidate():
+        """Помечает индексы всех процессов устаревшими."""
+        bump_version(INGREDIENTS)
+
+
+ingredient_index = IngredientIndex()
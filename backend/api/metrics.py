@@ -0,0 +1,300 @@
+"""
+Метрики запросов к API по вьюхам и действиям.
+
+MetricsMiddleware считает для каждого запроса число SQL-запросов, время
+SQL, время сериализации (чтения data у сериализаторов верхнего уровня,
+включая SQL-запросы, выполненные при этом), время рендеринга ответа,
+размер ответа и общее время,
+добавляет их в заголовок Server-Timing и складывает в счетчики процесса
+по вьюхе и действию. SQL учитывается обработчиком execute_wrapper,
+который ставится на каждое соединение при подключении, поэтому запросы
+из потоков асинхронных вьюх и из генераторов потоковых ответов тоже
+попадают в метрики своего запроса.
+
+Метрики выключены по умолчанию (METRICS_ENABLED). Счетчики отдаются в
+формате Prometheus адресом /metrics только адресам из METRICS_ALLOWED_IPS
+и персоналу. Счетчики свои у каждого процесса gunicorn. Запросы,
+превысившие QUERY_BUDGET SQL-запросов, пишутся в журнал вместе с
+отпечатками SQL.
+"""
+import logging
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+from threading import Lock
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import Http404, HttpResponse
+from rest_framework import serializers
+
+logger = logging.getLogger(__name__)
+
+current_metrics = ContextVar('current_metrics', default=None)
+
+FINGERPRINTS_LOGGED = 10
+FINGERPRINT_SUBSTITUTIONS = (
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'%s|\b\d+\b'), '?'),
+    (re.compile(r'\(\?(?:, \?)*\)'), '(?)'),
+    (re.compile(r'\(\?\)(?:, \(\?\))+'), '(?), ...'),
+    (re.compile(r'\s+'), ' '),
+)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+PROMETHEUS_METRICS = (
+    ('api_requests_total', 'requests', 'Количество запросов.'),
+    ('api_request_duration_seconds_total', 'duration',
+     'Суммарное время обработки запросов.'),
+    ('api_db_queries_total', 'queries', 'Количество SQL-запросов.'),
+    ('api_db_duration_seconds_total', 'sql_time',
+     'Суммарное время SQL-запросов.'),
+    ('api_serialize_seconds_total', 'serialize_time',
+     'Суммарное время сериализации ответов.'),
+    ('api_render_seconds_total', 'render_time',
+     'Суммарное время рендеринга ответов.'),
+    ('api_response_bytes_total', 'response_bytes',
+     'Суммарный размер ответов.'),
+    ('api_over_query_budget_total', 'over_budget',
+     'Количество запросов сверх QUERY_BUDGET.'),
+)
+
+
+def get_fingerprint(sql):
+    """Отпечаток SQL: запрос без значений параметров и литералов."""
+    for pattern, replacement in FINGERPRINT_SUBSTITUTIONS:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+class RequestMetrics:
+    """Метрики одного запроса."""
+
+    def __init__(self, collect_fingerprints=False):
+        self.started_at = time.perf_counter()
+        self.view = None
+        self.action = None
+        self.queries = 0
+        self.sql_time = 0.0
+        self.serializing = False
+        self.serialize_time = 0.0
+        self.render_time = 0.0
+        self.response_bytes = 0
+        self.duration = 0.0
+        self.fingerprints = Counter() if collect_fingerprints else None
+
+    def add_query(self, sql, duration):
+        self.queries += 1
+        self.sql_time += duration
+        if self.fingerprints is not None:
+            self.fingerprints[get_fingerprint(sql)] += 1
+
+    def get_server_timing(self):
+        return (
+            f'db;dur={self.sql_time * 1000:.2f};desc="{self.queries} SQL", '
+            f'serialize;dur={self.serialize_time * 1000:.2f}, '
+            f'render;dur={self.render_time * 1000:.2f}, '
+            f'total;dur={self.duration * 1000:.2f}'
+        )
+
+
+class MetricsRegistry:
+    """Счетчики метрик процесса по вьюхе и действию."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._endpoints = {}
+
+    def add(self, metrics, over_budget):
+        key = (metrics.view, metrics.action)
+        with self._lock:
+            totals = self._endpoints.setdefault(key, dict.fromkeys(
+                (name for _, name, _ in PROMETHEUS_METRICS), 0))
+            totals['requests'] += 1
+            totals['duration'] += metrics.duration
+            totals['queries'] += metrics.queries
+            totals['sql_time'] += metrics.sql_time
+            totals['serialize_time'] += metrics.serialize_time
+            totals['render_time'] += metrics.render_time
+            totals['response_bytes'] += metrics.response_bytes
+            totals['over_budget'] += over_budget
+
+    def export(self):
+        """Возвращает счетчики в текстовом формате Prometheus."""
+        with self._lock:
+            endpoints = sorted(
+                (key, dict(totals))
+                for key, totals in self._endpoints.items()
+            )
+        lines = []
+        for metric, name, description in PROMETHEUS_METRICS:
+            lines.append(f'# HELP {metric} {description}')
+            lines.append(f'# TYPE {metric} counter')
+            for (view, action), totals in endpoints:
+                lines.append(
+                    f'{metric}{{view="{view}",action="{action}"}} '
+                    f'{totals[name]}'
+                )
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def record_sql(execute, sql, params, many, context):
+    """execute_wrapper, учитывающий SQL-запросы текущего запроса к API."""
+    metrics = current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started_at = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.add_query(sql, time.perf_counter() - started_at)
+
+
+def install_sql_wrapper(connection):
+    if record_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_sql)
+
+
+def timed_data(data_property):
+    """
+    Оборачивает свойство data сериализатора учетом времени сериализации.
+
+    Учитывается только внешний вызов: data, прочитанное внутри другой
+    сериализации, уже входит в ее время.
+    """
+    def get_data(serializer):
+        metrics = current_metrics.get()
+        if metrics is None or metrics.serializing:
+            return data_property.fget(serializer)
+        metrics.serializing = True
+        started_at = time.perf_counter()
+        try:
+            return data_property.fget(serializer)
+        finally:
+            metrics.serializing = False
+            metrics.serialize_time += time.perf_counter() - started_at
+
+    get_data.timed = True
+    return property(get_data)
+
+
+def install_serializer_timing():
+    for serializer_class in (serializers.Serializer,
+                             serializers.ListSerializer):
+        data_property = serializer_class.__dict__['data']
+        if not getattr(data_property.fget, 'timed', False):
+            serializer_class.data = timed_data(data_property)
+
+
+def render_response(response):
+    """Рендерит ответ DRF, учитывая время рендеринга."""
+    if getattr(response, 'is_rendered', True):
+        return response
+    metrics = current_metrics.get()
+    started_at = time.perf_counter()
+    response.render()
+    if metrics is not None:
+        metrics.render_time += time.perf_counter() - started_at
+    return response
+
+
+def finish_request(request, metrics):
+    metrics.duration = time.perf_counter() - metrics.started_at
+    over_budget = 0 < settings.QUERY_BUDGET < metrics.queries
+    if over_budget:
+        logger.warning(
+            '%s %s (%s.%s): %d SQL-запросов при бюджете %d\n%s',
+            request.method,
+            request.get_full_path(),
+            metrics.view,
+            metrics.action,
+            metrics.queries,
+            settings.QUERY_BUDGET,
+            '\n'.join(
+                f'{count} x {fingerprint}'
+                for fingerprint, count in metrics.fingerprints.most_common(
+                    FINGERPRINTS_LOGGED)
+            ),
+        )
+    if metrics.view is not None:
+        registry.add(metrics, over_budget)
+
+
+def stream_with_metrics(request, parts, metrics):
+    """
+    Отдает части потокового ответа, учитывая их в метриках запроса.
+
+    SQL-запросы генератора выполняются уже после выхода из middleware,
+    поэтому метрики запроса делаются текущими на время чтения каждой
+    части, а в счетчики попадают после последней части.
+    """
+    try:
+        while True:
+            token = current_metrics.set(metrics)
+            try:
+                part = next(parts, None)
+            finally:
+                current_metrics.reset(token)
+            if part is None:
+                break
+            metrics.response_bytes += len(part)
+            yield part
+    finally:
+        finish_request(request, metrics)
+
+
+class MetricsMiddleware:
+    """Собирает метрики запроса и добавляет заголовок Server-Timing."""
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        install_serializer_timing()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = RequestMetrics(
+            collect_fingerprints=settings.QUERY_BUDGET > 0)
+        token = current_metrics.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        metrics.duration = time.perf_counter() - metrics.started_at
+        response['Server-Timing'] = metrics.get_server_timing()
+        if response.streaming:
+            response.streaming_content = stream_with_metrics(
+                request, iter(response.streaming_content), metrics)
+        else:
+            metrics.response_bytes = len(response.content)
+            finish_request(request, metrics)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = current_metrics.get()
+        method = request.method.lower()
+        view_class = getattr(view_func, 'cls', None)
+        if view_class is None:
+            metrics.view = view_func.__name__
+            metrics.action = method
+            return
+        metrics.view = view_class.__name__
+        actions = getattr(view_func, 'actions', None) or {}
+        metrics.action = actions.get(method, method)
+
+    def process_template_response(self, request, response):
+        return render_response(response)
+
+
+def metrics_view(request):
+    """Метрики процесса в формате Prometheus."""
+    if not request.user.is_staff and (
+            request.META.get('REMOTE_ADDR')
+            not in settings.METRICS_ALLOWED_IPS):
+        raise Http404
+    return HttpResponse(
+        registry.export(), content_type=PROMETHEUS_CONTENT_TYPE)
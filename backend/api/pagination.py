@@ -1,8 +1,148 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+import json
+from collections import OrderedDict
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q, QuerySet
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class FoodgramCursorPagination(BasePagination):
+    """
+    Пагинация по ключу сортировки (keyset).
+
+    Курсор хранит значения полей сортировки последней (или первой, для
+    обратного курсора) записи страницы, поэтому следующая страница
+    выбирается условием по индексу, без OFFSET и COUNT(*). Сортировка
+    должна однозначно упорядочивать записи, последним полем обычно
+    идет id.
+    """
+
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def __init__(self, ordering, page_size):
+        self.ordering = ordering
+        self.page_size = page_size
+
+    def encode_cursor(self, values, reverse):
+        values = [
+            value.isoformat() if isinstance(value, datetime) else value
+            for value in values
+        ]
+        cursor = json.dumps({'p': values, 'r': reverse})
+        return base64.urlsafe_b64encode(cursor.encode()).decode()
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            values, reverse = cursor['p'], bool(cursor['r'])
+        except (binascii.Error, ValueError, TypeError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values, reverse
+
+    def get_position(self, item):
+        return [getattr(item, field.lstrip('-')) for field in self.ordering]
+
+    def get_keyset_filter(self, values, reverse):
+        """Строит условие «запись идет после курсора» для сортировки."""
+        keyset_filter = Q()
+        equal = Q()
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            descending = field.startswith('-')
+            lookup = 'lt' if descending != reverse else 'gt'
+            keyset_filter |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return keyset_filter
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        values, self.reverse = self.decode_cursor(request)
+        self.has_cursor = values is not None
+        ordering = self.ordering
+        if self.reverse:
+            ordering = [
+                field[1:] if field.startswith('-') else f'-{field}'
+                for field in ordering
+            ]
+        queryset = queryset.order_by(*ordering)
+        if self.has_cursor:
+            try:
+                queryset = queryset.filter(
+                    self.get_keyset_filter(values, self.reverse))
+                results = list(queryset[:self.page_size + 1])
+            except (ValidationError, ValueError, TypeError):
+                raise NotFound(self.invalid_cursor_message)
+        else:
+            results = list(queryset[:self.page_size + 1])
+        self.has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if self.reverse:
+            self.page.reverse()
+        return self.page
+
+    def get_link(self, item, reverse):
+        url = remove_query_param(self.request.build_absolute_uri(), 'page')
+        return replace_query_param(
+            url, self.cursor_query_param,
+            self.encode_cursor(self.get_position(item), reverse))
+
+    def get_next_link(self):
+        if not self.page or not (self.has_more or self.reverse):
+            return None
+        return self.get_link(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.page or not (
+                self.has_more if self.reverse else self.has_cursor):
+            return None
+        return self.get_link(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
 
 
 class FoodgramPagination(PageNumberPagination):
-    """Кастомная пагинация."""
+    """
+    Кастомная пагинация.
+
+    По умолчанию работает постранично (параметры page и limit). При
+    наличии параметра cursor (пустое значение означает первую страницу)
+    переключается на пагинацию по ключу сортировки, которую вьюсет
+    задает методом get_cursor_ordering. Списки (например, заранее
+    ранжированные результаты) всегда пагинируются постранично.
+    """
 
     page_size = 6
     page_size_query_param = 'limit'
+    cursor_query_param = FoodgramCursorPagination.cursor_query_param
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        if self.cursor_query_param not in request.query_params or not (
+                isinstance(queryset, QuerySet)):
+            return super().paginate_queryset(queryset, request, view)
+        self.cursor_paginator = FoodgramCursorPagination(
+            view.get_cursor_ordering(), self.get_page_size(request))
+        return self.cursor_paginator.paginate_queryset(
+            queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
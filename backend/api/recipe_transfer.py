@@ -0,0 +1,360 @@
+"""
+Пакетный импорт и потоковый экспорт рецептов.
+
+Рецепты переносятся в формате NDJSON: одна запись в строке, теги,
+ингредиенты и автор задаются естественными ключами. В zip-архиве лежат
+файл recipes.ndjson и картинки, на которые записи ссылаются по имени
+внутри архива; в NDJSON без архива картинка передается строкой base64.
+"""
+import base64
+import json
+import os
+import zipfile
+from collections import Counter
+from io import TextIOWrapper
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.db.models import Prefetch
+from recipes.counters import change_counter
+from recipes.images import (MAX_IMAGE_SIZE, get_content_hash_name,
+                            schedule_renditions)
+from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag
+from recipes.search import update_search_documents
+
+from .cache import RECIPES, bump_version
+from .cookable_index import record_changes
+from .serializers import RecipeImportSerializer, RecipeSerializer
+
+User = get_user_model()
+
+RECIPES_FILE = 'recipes.ndjson'
+IMAGES_DIR = 'images'
+CHUNK_SIZE = 500
+COPY_BUFFER_SIZE = 64 * 1024
+
+
+def read_ndjson(stream):
+    """Возвращает тройки (номер строки, запись, ошибки)."""
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield line_number, None, {
+                'non_field_errors': ['Строка не является JSON-объектом.']}
+            continue
+        if not isinstance(record, dict):
+            yield line_number, None, {
+                'non_field_errors': ['Строка не является JSON-объектом.']}
+            continue
+        yield line_number, record, None
+
+
+def read_zip(file):
+    """Читает записи из архива, подставляя картинки из него же."""
+    with zipfile.ZipFile(file) as archive:
+        images = {info.filename: info for info in archive.infolist()}
+        with archive.open(RECIPES_FILE) as recipes_file:
+            records = read_ndjson(TextIOWrapper(recipes_file, 'utf-8'))
+            for line_number, record, errors in records:
+                image_name = record.get('image') if record else None
+                if not isinstance(image_name, str) or (
+                        image_name.startswith('data:')):
+                    yield line_number, record, errors
+                elif image_name not in images:
+                    yield line_number, None, {'image': [
+                        f'Картинка {image_name} не найдена в архиве.']}
+                elif images[image_name].file_size > MAX_IMAGE_SIZE:
+                    yield line_number, None, {'image': [
+                        'Размер картинки не должен превышать '
+                        f'{MAX_IMAGE_SIZE} байт.']}
+                else:
+                    record['image'] = ContentFile(
+                        archive.read(images[image_name]),
+                        name=os.path.basename(image_name))
+                    yield line_number, record, None
+
+
+def read_records(file):
+    """Определяет формат файла (zip или NDJSON) и читает записи."""
+    if zipfile.is_zipfile(file):
+        file.seek(0)
+        yield from read_zip(file)
+        return
+    file.seek(0)
+    yield from read_ndjson(TextIOWrapper(file, 'utf-8'))
+
+
+class RecipeImporter:
+    """
+    Импорт рецептов порциями.
+
+    Каждая запись проверяется сериализатором, затем ключи тегов,
+    ингредиентов и авторов всей порции разрешаются тремя запросами.
+    Корректные записи порции сохраняются в одной транзакции через
+    bulk_create, ошибочные пропускаются и попадают в отчет с номером
+    строки.
+    """
+
+    def __init__(self, author=None, chunk_size=CHUNK_SIZE):
+        self.author = author
+        self.chunk_size = chunk_size
+        self.created = 0
+        self.errors = []
+
+    def run(self, records):
+        chunk = []
+        for line_number, record, errors in records:
+            if errors is None:
+                serializer = RecipeImportSerializer(data=record)
+                if serializer.is_valid():
+                    chunk.append((line_number, serializer.validated_data))
+                else:
+                    errors = serializer.errors
+            if errors:
+                self.errors.append({'line': line_number, 'errors': errors})
+            if len(chunk) == self.chunk_size:
+                self.import_chunk(chunk)
+                chunk = []
+        if chunk:
+            self.import_chunk(chunk)
+        self.errors.sort(key=lambda error: error['line'])
+        return self.created, self.errors
+
+    def import_chunk(self, chunk):
+        tags = Tag.objects.in_bulk(
+            {slug for _, record in chunk for slug in record['tags']},
+            field_name='slug')
+        ingredients = {
+            (name, measurement_unit): ingredient_id
+            for ingredient_id, name, measurement_unit
+            in Ingredient.objects.filter(name__in={
+                ingredient['name']
+                for _, record in chunk
+                for ingredient in record['ingredients']
+            }).values_list('id', 'name', 'measurement_unit')
+        }
+        authors = User.objects.in_bulk(
+            {record['author'] for _, record in chunk if 'author' in record},
+            field_name='email')
+        valid = []
+        for line_number, record in chunk:
+            errors = self.resolve(record, tags, ingredients, authors)
+            if errors:
+                self.errors.append({'line': line_number, 'errors': errors})
+            else:
+                valid.append(record)
+        if valid:
+            self.write(valid)
+
+    def resolve(self, record, tags, ingredients, authors):
+        """Заменяет ключи записи объектами и возвращает ошибки."""
+        errors = {}
+        if 'author' in record:
+            record['author'] = authors.get(record['author'])
+            if record['author'] is None:
+                errors['author'] = ['Автор с таким email не найден.']
+        elif self.author is not None:
+            record['author'] = self.author
+        else:
+            errors['author'] = ['Не указан автор рецепта.']
+        tag_errors = RecipeSerializer.get_item_errors(
+            record['tags'], tags,
+            'Данного тега не существует!',
+            'Теги не могут повторяться!',
+        )
+        if tag_errors:
+            errors['tags'] = tag_errors
+        keys = [
+            (ingredient['name'], ingredient['measurement_unit'])
+            for ingredient in record['ingredients']
+        ]
+        ingredient_errors = RecipeSerializer.get_item_errors(
+            keys, ingredients,
+            'Данного ингредиента не существует!',
+            'Ингредиенты не могут повторяться!',
+        )
+        if ingredient_errors:
+            errors['ingredients'] = ingredient_errors
+        if errors:
+            return errors
+        record['tags'] = [tags[slug] for slug in record['tags']]
+        for key, ingredient in zip(keys, record['ingredients']):
+            ingredient['id'] = ingredients[key]
+        return None
+
+    @transaction.atomic
+    def write(self, records):
+        image_field = Recipe._meta.get_field('image')
+        images = {}
+        recipes = []
+        for record in records:
+            image = record['image']
+            image_name = get_content_hash_name(
+                image_field.generate_filename(None, image.name), image)
+            images[image_name] = image
+            recipes.append(Recipe(
+                author=record['author'],
+                name=record['name'],
+                text=record['text'],
+                cooking_time=record['cooking_time'],
+                image=image_name,
+            ))
+        transaction.on_commit(
+            lambda: save_images(image_field.storage, images))
+        if connection.features.can_return_rows_from_bulk_insert:
+            Recipe.objects.bulk_create(recipes, batch_size=self.chunk_size)
+            authors = Counter(recipe.author_id for recipe in recipes)
+            for author_id, count in authors.items():
+                change_counter(User, author_id, 'recipes_count', count)
+        else:
+            for recipe in recipes:
+                recipe.save()
+        RecipeIngredient.objects.bulk_create(
+            (
+                RecipeIngredient(
+                    recipe=recipe,
+                    ingredients_id=ingredient['id'],
+                    amount=ingredient['amount'],
+                )
+                for recipe, record in zip(recipes, records)
+                for ingredient in record['ingredients']
+            ),
+            batch_size=self.chunk_size,
+        )
+        Recipe.tags.through.objects.bulk_create(
+            (
+                Recipe.tags.through(recipe=recipe, tag=tag)
+                for recipe, record in zip(recipes, records)
+                for tag in record['tags']
+            ),
+            batch_size=self.chunk_size,
+        )
+        for recipe in recipes:
+            schedule_renditions(recipe.image.name)
+        recipe_ids = [recipe.id for recipe in recipes]
+        transaction.on_commit(lambda: update_search_documents(recipe_ids))
+        record_changes(recipe_ids)
+        bump_version(RECIPES)
+        self.created += len(recipes)
+
+
+def save_images(storage, images):
+    """
+    Сохраняет картинки импортированных рецептов.
+
+    Вызывается после фиксации транзакции порции, чтобы откат порции не
+    оставлял файлов без рецептов. Имена файлов определяются хешем
+    содержимого, поэтому известны до сохранения.
+    """
+    for image_name, image in images.items():
+        storage.save(image_name, image)
+
+
+def get_export_queryset():
+    return Recipe.objects.select_related('author').prefetch_related(
+        'tags',
+        Prefetch(
+            'recipe_ingredients',
+            queryset=RecipeIngredient.objects.select_related('ingredients')
+        ),
+    ).order_by('id')
+
+
+def iterate_recipes(queryset, chunk_size=CHUNK_SIZE):
+    """Перебирает рецепты порциями по возрастанию id."""
+    last_id = 0
+    while True:
+        chunk = list(queryset.filter(id__gt=last_id)[:chunk_size])
+        if not chunk:
+            return
+        yield from chunk
+        last_id = chunk[-1].id
+
+
+def serialize_recipe(recipe, image):
+    return json.dumps({
+        'name': recipe.name,
+        'text': recipe.text,
+        'cooking_time': recipe.cooking_time,
+        'author': recipe.author.email,
+        'tags': [tag.slug for tag in recipe.tags.all()],
+        'ingredients': [
+            {
+                'name': recipe_ingredient.ingredients.name,
+                'measurement_unit':
+                    recipe_ingredient.ingredients.measurement_unit,
+                'amount': recipe_ingredient.amount,
+            }
+            for recipe_ingredient in recipe.recipe_ingredients.all()
+        ],
+        'image': image,
+    }, ensure_ascii=False) + '\n'
+
+
+def encode_image(image):
+    extension = os.path.splitext(image.name)[1].lstrip('.').lower()
+    with image.open('rb') as file:
+        data = base64.b64encode(file.read()).decode()
+    return f'data:image/{extension};base64,{data}'
+
+
+def get_archive_name(image_name):
+    return f'{IMAGES_DIR}/{os.path.basename(image_name)}'
+
+
+def export_ndjson(queryset, chunk_size=CHUNK_SIZE):
+    """Отдает рецепты строками NDJSON с картинками в base64."""
+    for recipe in iterate_recipes(queryset, chunk_size):
+        yield serialize_recipe(recipe, encode_image(recipe.image))
+
+
+class ZipStream:
+    """Буфер без позиционирования, из которого zipfile читается частями."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def export_zip(queryset, chunk_size=CHUNK_SIZE):
+    """
+    Отдает zip-архив с recipes.ndjson и картинками рецептов.
+
+    Архив пишется в поток без позиционирования, поэтому отдается частями
+    по мере записи; картинки копируются из хранилища блоками.
+    """
+    stream = ZipStream()
+    storage = Recipe._meta.get_field('image').storage
+    with zipfile.ZipFile(stream, 'w') as archive:
+        recipes_info = zipfile.ZipInfo(RECIPES_FILE)
+        recipes_info.compress_type = zipfile.ZIP_DEFLATED
+        with archive.open(recipes_info, 'w') as recipes_file:
+            for recipe in iterate_recipes(queryset, chunk_size):
+                recipes_file.write(serialize_recipe(
+                    recipe, get_archive_name(recipe.image.name)).encode())
+                yield stream.drain()
+        image_names = queryset.select_related(None).prefetch_related(
+            None).order_by('image').values_list('image', flat=True).distinct()
+        for image_name in image_names.iterator():
+            with storage.open(image_name) as source, archive.open(
+                    get_archive_name(image_name), 'w') as target:
+                for block in iter(
+                        lambda: source.read(COPY_BUFFER_SIZE), b''):
+                    target.write(block)
+                    yield stream.drain()
+    yield stream.drain()
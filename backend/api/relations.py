@@ -0,0 +1,30 @@
+"""
+Добавление связей пользователя (избранное, корзина, подписки).
+
+Повторное добавление отсекается уникальными ограничениями таблиц, а не
+предварительной проверкой: строки вставляются одним
+INSERT ... ON CONFLICT DO NOTHING (INSERT OR IGNORE на SQLite), и число
+вставленных строк показывает, какие связи уже существовали.
+"""
+from django.db import connection
+
+
+def insert_ignore(model, fields, rows):
+    """Вставляет строки, пропуская конфликтующие; возвращает их число."""
+    if not rows:
+        return 0
+    ops = connection.ops
+    columns = ', '.join(
+        ops.quote_name(model._meta.get_field(name).column)
+        for name in fields
+    )
+    row_placeholders = f'({", ".join(["%s"] * len(fields))})'
+    sql = (
+        f'{ops.insert_statement(ignore_conflicts=True)} '
+        f'{ops.quote_name(model._meta.db_table)} ({columns}) '
+        f'VALUES {", ".join([row_placeholders] * len(rows))} '
+        f'{ops.ignore_conflicts_suffix_sql(ignore_conflicts=True)}'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [value for row in rows for value in row])
+        return cursor.rowcount
@@ -0,0 +1,47 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class StreamingRenderer(BaseRenderer):
+    """
+    Базовый рендерер потоковых выгрузок.
+
+    Выгрузка отдается потоковым ответом, поэтому рендерер участвует только
+    в выборе формата по параметру format или заголовку Accept.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return data
+
+
+class PlainTextRenderer(StreamingRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+
+class CSVRenderer(StreamingRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class PDFRenderer(StreamingRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+
+
+class NDJSONRenderer(StreamingRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+
+class ZipRenderer(StreamingRenderer):
+    media_type = 'application/zip'
+    format = 'zip'
+    charset = None
+
+
+SHOPPING_LIST_RENDERERS = (
+    PlainTextRenderer, CSVRenderer, JSONRenderer, PDFRenderer,
+)
+
+RECIPE_EXPORT_RENDERERS = (NDJSONRenderer, ZipRenderer)
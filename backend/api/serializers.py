@@ -1,33 +1,126 @@
 import base64
+import binascii
 import re
+from io import BytesIO
 
+from api.filters import get_search_query
 from api.validators import validate_username
 from django.contrib.auth import get_user_model
 from django.core.files.base import ContentFile
-from django.db.models import F
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F, Prefetch, Window, prefetch_related_objects
+from django.db.models.functions import RowNumber
 from djoser.serializers import UserCreateSerializer, UserSerializer
-from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
-                            ShoppingCart, Tag)
+from PIL import Image
+from recipes.images import (MAX_IMAGE_PIXELS, MAX_IMAGE_SIZE,
+                            get_content_hash_name, get_rendition_names)
+from recipes.models import (MAX_LENGTH, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, ShoppingCartIngredient, Tag)
+from recipes.search import get_snippets
 from rest_framework import serializers
 from rest_framework.fields import SerializerMethodField
-from users.models import Subscription
 
 MAX_FIELD_LENGTH = 150
+IMAGE_HEADER_LENGTH = 64 * 1024
+MAX_COOKABLE_INGREDIENTS = 100
+MAX_BATCH_RECIPES = 100
 User = get_user_model()
 
 
 class Base64ImageField(serializers.ImageField):
-    """Кастомный сериализатор, преобразующий картинки."""
+    """
+    Кастомный сериализатор, преобразующий картинки.
+
+    Размер файла и количество пикселей проверяются до декодирования
+    картинки: размер считается по длине base64-строки, а разрешение
+    читается из заголовка картинки в начале данных. Если заголовок не
+    помещается в начало данных (например, из-за больших EXIF), разрешение
+    читается по всем данным. Картинки, разрешение которых прочитать не
+    удалось, отклоняются.
+    """
+
+    default_error_messages = {
+        'invalid_base64': 'Картинка должна быть закодирована в base64.',
+        'too_large': 'Размер картинки не должен превышать {max_size} байт.',
+        'too_many_pixels': (
+            'Разрешение картинки не должно превышать {max_pixels} пикселей.'
+        ),
+        'unreadable_image': 'Не удалось определить разрешение картинки.',
+    }
+
+    def get_pixels(self, file):
+        """Читает разрешение из заголовка картинки, не декодируя ее."""
+        try:
+            with Image.open(file) as image:
+                width, height = image.size
+        except Image.DecompressionBombError:
+            self.fail('too_many_pixels', max_pixels=MAX_IMAGE_PIXELS)
+        except (OSError, SyntaxError, ValueError):
+            return None
+        return width * height
+
+    def check_pixels(self, pixels):
+        if pixels is None:
+            self.fail('unreadable_image')
+        if pixels > MAX_IMAGE_PIXELS:
+            self.fail('too_many_pixels', max_pixels=MAX_IMAGE_PIXELS)
 
     def to_internal_value(self, image_data):
         if isinstance(image_data, str) and image_data.startswith('data:image'):
             format, imgstr = image_data.split(';base64,')
             ext = format.split('/')[-1]
-            image_data = ContentFile(
-                base64.b64decode(imgstr), name=f'temp.{ext}')
+            if len(imgstr) * 3 // 4 > MAX_IMAGE_SIZE:
+                self.fail('too_large', max_size=MAX_IMAGE_SIZE)
+            try:
+                pixels = self.get_pixels(BytesIO(
+                    base64.b64decode(imgstr[:IMAGE_HEADER_LENGTH])))
+                if pixels is not None:
+                    self.check_pixels(pixels)
+                content = base64.b64decode(imgstr)
+            except binascii.Error:
+                self.fail('invalid_base64')
+            if pixels is None:
+                self.check_pixels(self.get_pixels(BytesIO(content)))
+            image_data = ContentFile(content, name=f'temp.{ext}')
+        elif hasattr(image_data, 'read'):
+            if image_data.size > MAX_IMAGE_SIZE:
+                self.fail('too_large', max_size=MAX_IMAGE_SIZE)
+            pixels = self.get_pixels(image_data)
+            image_data.seek(0)
+            self.check_pixels(pixels)
         return super().to_internal_value(image_data)
 
 
+class ImageRenditionsField(serializers.Field):
+    """
+    Ссылки на уменьшенные копии картинки рецепта.
+
+    Пока копия не построена, вместо нее отдается ссылка на оригинал.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        kwargs.setdefault('source', 'image')
+        super().__init__(**kwargs)
+
+    def to_representation(self, image):
+        if not image:
+            return None
+        request = self.context.get('request')
+        renditions = get_rendition_names(image.name)
+        for formats in renditions.values():
+            for image_format, name in formats.items():
+                if default_storage.exists(name):
+                    url = default_storage.url(name)
+                else:
+                    url = image.url
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+                formats[image_format] = url
+        return renditions
+
+
 class IngredientSerializer(serializers.ModelSerializer):
     """Сериализатор ингредиентов."""
 
@@ -65,6 +158,8 @@ class UsersSerializer(UserSerializer):
                   'is_subscribed',)
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context.get('request')
         return obj.following.filter(user_id=request.user.id).exists()
 
@@ -72,20 +167,69 @@ class UsersSerializer(UserSerializer):
 class MiniRecipeSerializer(serializers.ModelSerializer):
     """Сериализатор короткой формы рецептов."""
 
+    image_renditions = ImageRenditionsField()
+
     class Meta:
         model = Recipe
         fields = (
             'id',
             'name',
             'image',
+            'image_renditions',
             'cooking_time'
         )
 
 
+def get_recipes_limit(request):
+    """Возвращает значение параметра recipes_limit или None."""
+    limit = request.GET.get('recipes_limit')
+    if limit and limit.isdigit():
+        return int(limit)
+    return None
+
+
+class SubscriptionListSerializer(serializers.ListSerializer):
+    """
+    Сериализатор списка подписок.
+
+    Загружает превью рецептов для всех авторов страницы одним запросом:
+    при заданном recipes_limit рецепты нумеруются оконной функцией
+    ROW_NUMBER() в разрезе автора и отсекаются по номеру. Порядок превью
+    тот же, что и без recipes_limit: по дате публикации и id.
+    """
+
+    def to_representation(self, data):
+        authors = list(data)
+        author_ids = [author.id for author in authors]
+        limit = get_recipes_limit(self.context.get('request'))
+        recipes = Recipe.objects.filter(
+            author_id__in=author_ids
+        ).only(
+            'id', 'name', 'image', 'cooking_time', 'author_id', 'pub_date')
+        if limit is not None:
+            ranked = recipes.annotate(row_number=Window(
+                expression=RowNumber(),
+                partition_by=F('author_id'),
+                order_by=[F('pub_date').desc(), F('id').desc()],
+            )).order_by()
+            sql, params = ranked.query.sql_with_params()
+            recipes = Recipe.objects.raw(
+                f'SELECT * FROM ({sql}) ranked '
+                f'WHERE ranked.row_number <= %s '
+                f'ORDER BY ranked.pub_date DESC, ranked.id DESC',
+                (*params, limit)
+            )
+        recipes_by_author = {author_id: [] for author_id in author_ids}
+        for recipe in recipes:
+            recipes_by_author[recipe.author_id].append(recipe)
+        self.child.context['recipes_by_author'] = recipes_by_author
+        return super().to_representation(authors)
+
+
 class SubscriptionSerializer(UsersSerializer):
     """Сериализатор подписок."""
 
-    recipes_count = SerializerMethodField()
+    recipes_count = serializers.IntegerField(read_only=True)
     recipes = SerializerMethodField()
 
     class Meta(UsersSerializer.Meta):
@@ -94,36 +238,17 @@ class SubscriptionSerializer(UsersSerializer):
         )
         read_only_fields = ('email', 'username',
                             'first_name', 'last_name')
-
-    def validate(self, data):
-        following = self.instance
-        user = self.context.get('request').user
-        subscription = Subscription.objects.filter(
-            following=following, user=user
-        )
-        if self.context.get('request').method == 'POST':
-            if subscription.exists():
-                raise serializers.ValidationError(
-                    'Вы уже подписаны на этого пользователя!')
-            if user == following:
-                raise serializers.ValidationError(
-                    'Вы не можете подписаться на самого себя!')
-        if self.context.get('request').method == 'DELETE':
-            if not subscription.exists():
-                raise serializers.ValidationError(
-                    'Нельзя отменить несуществующую подписку!'
-                )
-        return data
-
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
+        list_serializer_class = SubscriptionListSerializer
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        limit = request.GET.get('recipes_limit')
-        recipes = obj.recipes.all()
-        if limit:
-            recipes = recipes[:int(limit)]
+        recipes_by_author = self.context.get('recipes_by_author')
+        if recipes_by_author is not None:
+            recipes = recipes_by_author.get(obj.id, [])
+        else:
+            limit = get_recipes_limit(self.context.get('request'))
+            recipes = obj.recipes.all()
+            if limit is not None:
+                recipes = recipes[:limit]
         serializer = MiniRecipeSerializer(recipes, many=True, read_only=True)
         return serializer.data
 
@@ -158,6 +283,23 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
         return amount_value
 
 
+class RecipeListSerializer(serializers.ListSerializer):
+    """
+    Сериализатор списка рецептов.
+
+    При поиске загружает подсвеченные фрагменты для всей страницы одним
+    запросом.
+    """
+
+    def to_representation(self, data):
+        recipes = list(data)
+        query = get_search_query(self.context.get('request'))
+        if query:
+            self.child.context['search_snippets'] = get_snippets(
+                [recipe.id for recipe in recipes], query)
+        return super().to_representation(recipes)
+
+
 class RecipeGetSerializer(serializers.ModelSerializer):
     """Сериализатор рецептов для безопасных запросов."""
 
@@ -166,6 +308,7 @@ class RecipeGetSerializer(serializers.ModelSerializer):
     ingredients = serializers.SerializerMethodField()
     is_favorited = serializers.SerializerMethodField(read_only=True)
     is_in_shopping_cart = serializers.SerializerMethodField(read_only=True)
+    image_renditions = ImageRenditionsField()
 
     class Meta:
         model = Recipe
@@ -178,26 +321,43 @@ class RecipeGetSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'image_renditions',
             'text',
             'cooking_time',
         )
+        list_serializer_class = RecipeListSerializer
+
+    def to_representation(self, instance):
+        representation = super().to_representation(instance)
+        if hasattr(instance, 'search_rank'):
+            representation['search_rank'] = instance.search_rank
+            representation['search_snippet'] = self.context.get(
+                'search_snippets', {}).get(instance.id)
+        return representation
 
     def get_ingredients(self, obj):
-        recipe = obj
-        return recipe.ingredients.values(
-            'id',
-            'name',
-            'measurement_unit',
-            amount=F('recipe_ingredients__amount')
-        )
+        return [
+            {
+                'id': recipe_ingredient.ingredients.id,
+                'name': recipe_ingredient.ingredients.name,
+                'measurement_unit':
+                    recipe_ingredient.ingredients.measurement_unit,
+                'amount': recipe_ingredient.amount,
+            }
+            for recipe_ingredient in obj.recipe_ingredients.all()
+        ]
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         user = self.context.get('request').user
         if user.is_anonymous:
             return False
         return user.favorites.filter(recipe=obj).exists()
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         user = self.context.get('request').user
         if user.is_anonymous:
             return False
@@ -207,8 +367,8 @@ class RecipeGetSerializer(serializers.ModelSerializer):
 class RecipeSerializer(serializers.ModelSerializer):
     """Сериализатор рецептов."""
 
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(), many=True, required=True)
+    tags = serializers.ListField(
+        child=serializers.IntegerField(), required=True)
     image = Base64ImageField()
     author = UserSerializer(read_only=True)
     ingredients = RecipeIngredientSerializer(
@@ -233,25 +393,58 @@ class RecipeSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError({
                 'recipe_ingredients': 'Поле ингредиентов обязательно!'
             })
-        ingredient_ids = []
-        for ingredient in ingredients_data:
-            if not Ingredient.objects.filter(id=ingredient['ingredients']['id']
-                                             ).exists():
-                raise serializers.ValidationError(
-                    'Данного ингредиента не существует!')
-            if ingredient['ingredients']['id'] in ingredient_ids:
-                raise serializers.ValidationError(
-                    'Ингредиенты не могут повторяться!')
-            ingredient_ids.append(ingredient['ingredients']['id'])
         tags_data = data.get('tags')
         if not tags_data:
             raise serializers.ValidationError({
                 'tags': 'Поле тегов обязательно!'
             })
-        if len(tags_data) != len(set(tags_data)):
-            raise serializers.ValidationError('Теги не могут повторяться!')
+        ingredient_ids = [
+            ingredient['ingredients']['id'] for ingredient in ingredients_data]
+        existing_ingredient_ids = set(Ingredient.objects.filter(
+            id__in=ingredient_ids).values_list('id', flat=True))
+        tags = Tag.objects.in_bulk(tags_data)
+        errors = {}
+        ingredient_errors = self.get_item_errors(
+            ingredient_ids, existing_ingredient_ids,
+            'Данного ингредиента не существует!',
+            'Ингредиенты не могут повторяться!',
+        )
+        if ingredient_errors:
+            errors['ingredients'] = {
+                index: {'id': messages}
+                for index, messages in ingredient_errors.items()
+            }
+        tag_errors = self.get_item_errors(
+            tags_data, tags,
+            'Данного тега не существует!',
+            'Теги не могут повторяться!',
+        )
+        if tag_errors:
+            errors['tags'] = tag_errors
+        if errors:
+            raise serializers.ValidationError(errors)
+        data['tags'] = [tags[tag_id] for tag_id in tags_data]
         return data
 
+    @staticmethod
+    def get_item_errors(ids, existing_ids, missing_message,
+                        duplicate_message):
+        """
+        Возвращает ошибки элементов списка id по их индексам.
+
+        Отмечаются все несуществующие id и все повторы, кроме первого
+        вхождения.
+        """
+        errors = {}
+        seen = set()
+        for index, item_id in enumerate(ids):
+            if item_id not in existing_ids:
+                errors[index] = [missing_message]
+            elif item_id in seen:
+                errors[index] = [duplicate_message]
+            seen.add(item_id)
+        return errors
+
     def create_ingredients(self, recipe, ingredients_data):
         recipe_ingredients = (
             RecipeIngredient(
@@ -265,6 +458,7 @@ class RecipeSerializer(serializers.ModelSerializer):
     def create_tags(self, recipe, tags_data):
         recipe.tags.set(tags_data)
 
+    @transaction.atomic
     def create(self, validated_data):
         tags_data = validated_data.pop('tags')
         ingredients_data = validated_data.pop('recipe_ingredients')
@@ -273,78 +467,175 @@ class RecipeSerializer(serializers.ModelSerializer):
         self.create_tags(recipe, tags_data)
         return recipe
 
+    def update_ingredients(self, recipe, ingredients_data):
+        """
+        Приводит ингредиенты рецепта к новому составу.
+
+        Выполняются только нужные удаления, вставки и изменения
+        количеств. Возвращает прежние и новые количества в виде словарей
+        {ingredient_id: amount}.
+        """
+        existing = {
+            recipe_ingredient.ingredients_id: recipe_ingredient
+            for recipe_ingredient in RecipeIngredient.objects.filter(
+                recipe=recipe)
+        }
+        old_amounts = {
+            ingredient_id: recipe_ingredient.amount
+            for ingredient_id, recipe_ingredient in existing.items()
+        }
+        new_amounts = {
+            ingredient_data['ingredients']['id']: ingredient_data['amount']
+            for ingredient_data in ingredients_data
+        }
+        removed_ids = [
+            recipe_ingredient.id
+            for ingredient_id, recipe_ingredient in existing.items()
+            if ingredient_id not in new_amounts
+        ]
+        if removed_ids:
+            RecipeIngredient.objects.filter(id__in=removed_ids).delete()
+        changed = []
+        for ingredient_id, recipe_ingredient in existing.items():
+            amount = new_amounts.get(ingredient_id)
+            if amount is not None and amount != recipe_ingredient.amount:
+                recipe_ingredient.amount = amount
+                changed.append(recipe_ingredient)
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ('amount',))
+        added = [
+            ingredient_data for ingredient_data in ingredients_data
+            if ingredient_data['ingredients']['id'] not in existing
+        ]
+        if added:
+            self.create_ingredients(recipe, added)
+        return old_amounts, new_amounts
+
+    def is_new_image(self, recipe, image):
+        name = recipe.image.field.generate_filename(recipe, image.name)
+        return get_content_hash_name(name, image) != recipe.image.name
+
+    @transaction.atomic
     def update(self, instance, validated_data):
+        Recipe.objects.select_for_update().filter(pk=instance.pk).exists()
         instance.name = validated_data.get('name', instance.name)
-        instance.image = validated_data.get('image', instance.image)
         instance.text = validated_data.get('text', instance.text)
         instance.cooking_time = validated_data.get(
             'cooking_time', instance.cooking_time)
+        image = validated_data.get('image')
+        if image is not None and self.is_new_image(instance, image):
+            instance.image = image
 
         ingredients_data = validated_data.pop('recipe_ingredients', [])
-        instance.recipe_ingredients.all().delete()
-        self.create_ingredients(instance, ingredients_data)
-        tags_data = validated_data.pop('tags', [])
-        instance.tags.clear()
-        self.create_tags(instance, tags_data)
+        old_amounts, new_amounts = self.update_ingredients(
+            instance, ingredients_data)
+        if old_amounts != new_amounts:
+            ShoppingCartIngredient.objects.update_recipe(
+                instance.id, old_amounts, new_amounts)
+        if 'tags' in validated_data:
+            instance.tags.set(validated_data.pop('tags'))
 
         instance.save()
         return instance
 
     def to_representation(self, instance):
+        prefetch_related_objects(
+            (instance,),
+            'tags',
+            Prefetch(
+                'recipe_ingredients',
+                queryset=RecipeIngredient.objects.select_related('ingredients')
+            ),
+        )
         request = self.context.get('request')
         context = {'request': request}
         return RecipeGetSerializer(instance, context=context).data
 
 
-class BaseRecipeActionSerializer(serializers.ModelSerializer):
-    """Базовый сериализатор для Избранного и Корзины покупок."""
+class RecipeBatchSerializer(serializers.Serializer):
+    """Сериализатор списка рецептов для пакетных операций."""
 
-    user = serializers.PrimaryKeyRelatedField(queryset=User.objects.all())
-    recipe = serializers.PrimaryKeyRelatedField(queryset=Recipe.objects.all())
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=MAX_BATCH_RECIPES,
+    )
 
-    class Meta:
-        fields = ('recipe', 'user')
+    def validate_recipes(self, recipes):
+        return list(dict.fromkeys(recipes))
 
-    def validate(self, data):
-        recipe_value = data.get('recipe')
+
+class ShoppingCartDownloadSerializer(serializers.Serializer):
+    """Сериализатор скачивания Корзины покупок."""
+
+    user = serializers.PrimaryKeyRelatedField(queryset=User.objects.all())
+
+    def validate(self, shopping_cart_data):
         user = self.context.get('request').user
+        if not ShoppingCart.objects.filter(user=user).exists():
+            raise serializers.ValidationError('Корзина покупок пуста')
+        return shopping_cart_data
 
-        if not Recipe.objects.filter(id=recipe_value.id).exists():
-            raise serializers.ValidationError('Данного рецепта не существует!')
 
-        if self.Meta.model.objects.filter(user=user,
-                                          recipe=recipe_value).exists():
-            raise serializers.ValidationError('Рецепт уже добавлен.')
+class RecipeTransferIngredientSerializer(serializers.Serializer):
+    """Ингредиент рецепта при переносе: ссылка по названию и единице."""
 
-        return data
+    name = serializers.CharField(max_length=MAX_LENGTH)
+    measurement_unit = serializers.CharField(max_length=MAX_LENGTH)
+    amount = serializers.IntegerField(min_value=1)
 
-    def to_representation(self, instance):
-        representation = super().to_representation(instance)
-        representation['recipe'] = MiniRecipeSerializer(instance.recipe).data
-        return representation['recipe']
 
+class RecipeImportSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор записи импорта рецептов.
 
-class FavoriteSerializer(BaseRecipeActionSerializer):
-    """Сериализатор Избранного."""
+    Теги, ингредиенты и автор задаются естественными ключами (slug,
+    название с единицей измерения, email), поэтому записи переносятся
+    между окружениями с разными id. Существование ключей проверяется
+    пакетно для всей порции записей.
+    """
 
-    class Meta(BaseRecipeActionSerializer.Meta):
-        model = Favorite
+    author = serializers.EmailField(required=False)
+    tags = serializers.ListField(
+        child=serializers.SlugField(), allow_empty=False)
+    ingredients = RecipeTransferIngredientSerializer(
+        many=True, allow_empty=False)
+    image = Base64ImageField()
 
+    class Meta:
+        model = Recipe
+        fields = (
+            'name',
+            'text',
+            'cooking_time',
+            'author',
+            'tags',
+            'ingredients',
+            'image',
+        )
 
-class ShoppingCartSerializer(BaseRecipeActionSerializer):
-    """Сериализатор Корзины покупок."""
 
-    class Meta(BaseRecipeActionSerializer.Meta):
-        model = ShoppingCart
+class CookableQuerySerializer(serializers.Serializer):
+    """Параметры подбора рецептов по имеющимся ингредиентам."""
 
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=MAX_COOKABLE_INGREDIENTS,
+    )
+    max_missing = serializers.IntegerField(min_value=0, required=False)
 
-class ShoppingCartDownloadSerializer(serializers.Serializer):
-    """Сериализатор скачивания Корзины покупок."""
 
-    user = serializers.PrimaryKeyRelatedField(queryset=User.objects.all())
+class CookableRecipeSerializer(MiniRecipeSerializer):
+    """Рецепт с покрытием набора ингредиентов пользователя."""
 
-    def validate(self, shopping_cart_data):
-        user = self.context.get('request').user
-        if not ShoppingCart.objects.filter(user=user).exists():
-            raise serializers.ValidationError('Корзина покупок пуста')
-        return shopping_cart_data
+    matched_count = serializers.IntegerField(read_only=True)
+    total_count = serializers.IntegerField(read_only=True)
+    missing_ingredients = IngredientSerializer(many=True, read_only=True)
+
+    class Meta(MiniRecipeSerializer.Meta):
+        fields = MiniRecipeSerializer.Meta.fields + (
+            'matched_count',
+            'total_count',
+            'missing_ingredients',
+        )
@@ -0,0 +1,228 @@
+"""
+Потоковая выгрузка списка покупок.
+
+Каждая функция выгрузки принимает итератор строк списка покупок
+(словари с ключами name, measurement_unit и amount) и отдает документ
+частями, не накапливая его целиком в памяти.
+"""
+import csv
+import json
+import textwrap
+import zlib
+from datetime import datetime
+
+PDF_PAGE_WIDTH = 595
+PDF_PAGE_HEIGHT = 842
+PDF_MARGIN = 50
+PDF_FONT_SIZE = 11
+PDF_LEADING = 16
+PDF_LINE_WIDTH = 90
+PDF_LINES_PER_PAGE = (PDF_PAGE_HEIGHT - 2 * PDF_MARGIN) // PDF_LEADING
+CSV_HEADER = ('Ингредиент', 'Единица измерения', 'Количество')
+
+
+def get_title(user):
+    return f'Список покупок для {user.get_full_name()}'
+
+
+def get_footer(today):
+    return f'Foodgram ({today:%Y})'
+
+
+def format_ingredient(ingredient):
+    return (
+        f'- {ingredient["name"]} '
+        f'({ingredient["measurement_unit"]})'
+        f' - {ingredient["amount"]}'
+    )
+
+
+def export_txt(ingredients, user, today):
+    yield f'{get_title(user)}\n\n'
+    yield f'Дата: {today:%Y-%m-%d}\n\n'
+    for ingredient in ingredients:
+        yield f'{format_ingredient(ingredient)}\n'
+    yield f'\n{get_footer(today)}'
+
+
+class Echo:
+    """Псевдобуфер для csv.writer, возвращающий записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+def export_csv(ingredients, user, today):
+    writer = csv.writer(Echo())
+    yield '\ufeff' + writer.writerow(CSV_HEADER)
+    for ingredient in ingredients:
+        yield writer.writerow((
+            ingredient['name'],
+            ingredient['measurement_unit'],
+            ingredient['amount'],
+        ))
+
+
+def export_json(ingredients, user, today):
+    header = json.dumps(
+        {'user': user.get_full_name(), 'date': f'{today:%Y-%m-%d}'},
+        ensure_ascii=False,
+    )
+    yield header[:-1] + ', "ingredients": ['
+    separator = ''
+    for ingredient in ingredients:
+        yield separator + json.dumps({
+            'name': ingredient['name'],
+            'measurement_unit': ingredient['measurement_unit'],
+            'amount': ingredient['amount'],
+        }, ensure_ascii=False)
+        separator = ', '
+    yield ']}'
+
+
+def get_pdf_glyph_names():
+    """
+    Возвращает имена глифов кириллицы для кодировки cp1251.
+
+    Стандартные шрифты PDF не содержат кириллицы в кодировке
+    WinAnsiEncoding, поэтому байты 0xC0-0xFF и буквы Ё/ё переназначаются
+    на глифы по именам из Adobe Glyph List.
+    """
+    uppercase = [f'/afii{10017 + index}' for index in range(6)] + [
+        f'/afii{10018 + index}' for index in range(6, 32)]
+    lowercase = [f'/afii{10065 + index}' for index in range(6)] + [
+        f'/afii{10066 + index}' for index in range(6, 32)]
+    return (
+        '168 /afii10023 184 /afii10071 192 '
+        + ' '.join(uppercase + lowercase)
+    )
+
+
+def escape_pdf_text(line):
+    text = line.encode('cp1251', errors='replace')
+    return (
+        text.replace(b'\\', b'\\\\')
+        .replace(b'(', b'\\(')
+        .replace(b')', b'\\)')
+    )
+
+
+class PDFStreamWriter:
+    """
+    Постраничный генератор PDF-документа.
+
+    Страницы записываются в выходной поток по мере заполнения; в памяти
+    хранятся только смещения объектов, необходимые для таблицы xref.
+    Объекты 1-3 (каталог, дерево страниц и шрифт) зарезервированы, дерево
+    страниц записывается в конце, когда известен список страниц.
+    """
+
+    CATALOG, PAGES, FONT = 1, 2, 3
+
+    def __init__(self):
+        self.offsets = {}
+        self.position = 0
+        self.page_ids = []
+        self.next_id = self.FONT + 1
+
+    def write(self, data):
+        self.position += len(data)
+        return data
+
+    def write_object(self, object_id, body):
+        self.offsets[object_id] = self.position
+        return self.write(
+            f'{object_id} 0 obj\n'.encode() + body + b'\nendobj\n')
+
+    def start(self):
+        yield self.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        yield self.write_object(self.FONT, (
+            '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica '
+            '/Encoding << /Type /Encoding /BaseEncoding /WinAnsiEncoding '
+            f'/Differences [{get_pdf_glyph_names()}] >> >>'
+        ).encode())
+
+    def page(self, lines):
+        content = [
+            f'BT /F1 {PDF_FONT_SIZE} Tf {PDF_LEADING} TL '
+            f'{PDF_MARGIN} {PDF_PAGE_HEIGHT - PDF_MARGIN} Td'.encode()
+        ]
+        for line in lines:
+            content.append(b'(' + escape_pdf_text(line) + b') Tj T*')
+        content.append(b'ET')
+        stream = zlib.compress(b'\n'.join(content))
+        content_id, page_id = self.next_id, self.next_id + 1
+        self.next_id += 2
+        self.page_ids.append(page_id)
+        yield self.write_object(content_id, (
+            f'<< /Length {len(stream)} /Filter /FlateDecode >>\n'
+            'stream\n'
+        ).encode() + stream + b'\nendstream')
+        yield self.write_object(page_id, (
+            f'<< /Type /Page /Parent {self.PAGES} 0 R '
+            f'/MediaBox [0 0 {PDF_PAGE_WIDTH} {PDF_PAGE_HEIGHT}] '
+            f'/Resources << /Font << /F1 {self.FONT} 0 R >> >> '
+            f'/Contents {content_id} 0 R >>'
+        ).encode())
+
+    def finish(self):
+        kids = ' '.join(f'{page_id} 0 R' for page_id in self.page_ids)
+        yield self.write_object(self.PAGES, (
+            f'<< /Type /Pages /Kids [{kids}] '
+            f'/Count {len(self.page_ids)} >>'
+        ).encode())
+        yield self.write_object(
+            self.CATALOG, f'<< /Type /Catalog /Pages {self.PAGES} 0 R >>'
+            .encode())
+        xref_position = self.position
+        xref = [f'xref\n0 {self.next_id}\n', '0000000000 65535 f \n']
+        xref.extend(
+            f'{self.offsets[object_id]:010d} 00000 n \n'
+            for object_id in range(1, self.next_id)
+        )
+        xref.append(
+            f'trailer\n<< /Size {self.next_id} '
+            f'/Root {self.CATALOG} 0 R >>\n'
+            f'startxref\n{xref_position}\n%%EOF\n'
+        )
+        yield self.write(''.join(xref).encode())
+
+
+def get_pdf_lines(ingredients, user, today):
+    yield get_title(user)
+    yield ''
+    yield f'Дата: {today:%Y-%m-%d}'
+    yield ''
+    for ingredient in ingredients:
+        yield from textwrap.wrap(
+            format_ingredient(ingredient), PDF_LINE_WIDTH,
+            subsequent_indent='  ')
+    yield ''
+    yield get_footer(today)
+
+
+def export_pdf(ingredients, user, today):
+    writer = PDFStreamWriter()
+    yield from writer.start()
+    lines = []
+    for line in get_pdf_lines(ingredients, user, today):
+        lines.append(line)
+        if len(lines) == PDF_LINES_PER_PAGE:
+            yield from writer.page(lines)
+            lines = []
+    if lines or not writer.page_ids:
+        yield from writer.page(lines)
+    yield from writer.finish()
+
+
+EXPORTERS = {
+    'txt': export_txt,
+    'csv': export_csv,
+    'json': export_json,
+    'pdf': export_pdf,
+}
+
+
+def export_shopping_list(export_format, ingredients, user):
+    """Возвращает генератор частей списка покупок в заданном формате."""
+    return EXPORTERS[export_format](ingredients, user, datetime.today())
@@ -0,0 +1,203 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.signals import request_started
+from django.db import connections, transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+from django.utils import timezone
+from recipes.counters import change_counter
+from recipes.images import renditions_built, schedule_renditions
+from recipes.models import (Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCartIngredient, Tag)
+from recipes.search import delete_fts_rows, update_search_documents
+from rest_framework.authtoken.models import Token
+
+from .authentication import invalidate_tokens
+from .cache import INGREDIENTS, RECIPES, TAGS, bump_version
+from .cookable_index import record_changes
+from .metrics import install_sql_wrapper
+
+User = get_user_model()
+
+AUTHOR_FEED_FIELDS = ('email', 'username', 'first_name', 'last_name')
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def bump_tags_version(**kwargs):
+    bump_version(TAGS)
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def bump_ingredients_version(**kwargs):
+    bump_version(INGREDIENTS)
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_recipe_from_shopping_carts(instance, **kwargs):
+    ShoppingCartIngredient.objects.remove_recipe_from_all(instance.id)
+
+
+@receiver(post_save, sender=Recipe)
+def build_image_renditions(instance, **kwargs):
+    schedule_renditions(instance.image.name)
+
+
+@receiver(post_save, sender=Recipe)
+def increment_recipes_count(instance, created, **kwargs):
+    if created:
+        change_counter(User, instance.author_id, 'recipes_count', 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def decrement_recipes_count(instance, **kwargs):
+    change_counter(User, instance.author_id, 'recipes_count', -1)
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def bump_recipes_version(**kwargs):
+    bump_version(RECIPES)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def bump_recipes_version_on_tags_change(action, **kwargs):
+    if action.startswith('post_'):
+        bump_version(RECIPES)
+
+
+@receiver(pre_save, sender=User)
+def check_author_feed_fields(instance, update_fields=None, **kwargs):
+    """
+    Отмечает, изменились ли данные автора, выводимые в ленте рецептов.
+
+    Регистрация, смена пароля и вход не должны сбрасывать кэш ленты,
+    поэтому сохраненные значения сравниваются только у авторов рецептов
+    и только если сохраняются поля из AUTHOR_FEED_FIELDS.
+    """
+    instance.author_feed_changed = False
+    if instance._state.adding or not instance.recipes_count or (
+            update_fields is not None
+            and not set(update_fields) & set(AUTHOR_FEED_FIELDS)):
+        return
+    stored = User.objects.filter(pk=instance.pk).values_list(
+        *AUTHOR_FEED_FIELDS).first()
+    instance.author_feed_changed = stored != tuple(
+        getattr(instance, field) for field in AUTHOR_FEED_FIELDS)
+
+
+@receiver(post_save, sender=User)
+def bump_recipes_version_on_author_change(instance, **kwargs):
+    if getattr(instance, 'author_feed_changed', False):
+        bump_version(RECIPES)
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def record_recipe_ingredients_change(instance, **kwargs):
+    record_changes((instance.id,))
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def record_recipe_ingredient_change(instance, **kwargs):
+    record_changes((instance.recipe_id,))
+
+
+@receiver(pre_delete, sender=Ingredient)
+def record_ingredient_delete(instance, **kwargs):
+    record_changes(RecipeIngredient.objects.filter(
+        ingredients=instance).values_list('recipe_id', flat=True))
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_search_document(instance, **kwargs):
+    transaction.on_commit(lambda: update_search_documents((instance.id,)))
+
+
+@receiver(post_delete, sender=Recipe)
+def delete_recipe_search_document(instance, **kwargs):
+    delete_fts_rows((instance.id,))
+
+
+@receiver(post_save, sender=Ingredient)
+def update_ingredient_search_documents(instance, created, **kwargs):
+    if created:
+        return
+    recipe_ids = list(RecipeIngredient.objects.filter(
+        ingredients=instance).values_list('recipe_id', flat=True))
+    if recipe_ids:
+        transaction.on_commit(lambda: update_search_documents(recipe_ids))
+
+
+def touch_recipes(recipes):
+    """
+    Обновляет дату изменения рецептов.
+
+    Вызывается, когда меняются данные, входящие в представление рецепта
+    (теги, ингредиенты, автор), чтобы сменились валидаторы условных
+    запросов.
+    """
+    recipes.update(updated_at=timezone.now())
+
+
+@receiver((post_save, pre_delete), sender=Tag)
+def touch_tag_recipes(instance, created=False, **kwargs):
+    if not created:
+        touch_recipes(Recipe.objects.filter(tags=instance))
+
+
+@receiver((post_save, pre_delete), sender=Ingredient)
+def touch_ingredient_recipes(instance, created=False, **kwargs):
+    if not created:
+        touch_recipes(Recipe.objects.filter(
+            recipe_ingredients__ingredients=instance))
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(instance, **kwargs):
+    key = instance.key
+    transaction.on_commit(lambda: invalidate_tokens((key,)))
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(instance, created, update_fields=None, **kwargs):
+    if created or update_fields and set(update_fields) <= {'last_login'}:
+        return
+    keys = list(Token.objects.filter(
+        user=instance).values_list('key', flat=True))
+    if keys:
+        transaction.on_commit(lambda: invalidate_tokens(keys))
+
+
+@receiver(renditions_built)
+def refresh_recipes_with_renditions(image_name, **kwargs):
+    """Заменяет в кэше ссылки на оригинал ссылками на новые копии."""
+    touch_recipes(Recipe.objects.filter(image=image_name))
+    bump_version(RECIPES)
+
+
+@receiver(post_save, sender=User)
+def touch_author_recipes(instance, **kwargs):
+    if getattr(instance, 'author_feed_changed', False):
+        touch_recipes(Recipe.objects.filter(author=instance))
+
+
+@receiver(request_started)
+def check_database_connections(**kwargs):
+    """
+    Закрывает сохраненные соединения, которые перестали отвечать.
+
+    Аналог CONN_HEALTH_CHECKS из Django 4.1: соединение, оставшееся от
+    прошлого запроса при CONN_MAX_AGE > 0, проверяется в начале запроса,
+    чтобы запрос не упал на соединении, закрытом сервером или PgBouncer.
+    """
+    for connection in connections.all():
+        if connection.connection is not None and (
+                connection.settings_dict.get('CONN_HEALTH_CHECKS')) and (
+                not connection.is_usable()):
+            connection.close()
+
+
+@receiver(connection_created)
+def add_metrics_sql_wrapper(connection, **kwargs):
+    if settings.METRICS_ENABLED:
+        install_sql_wrapper(connection)
@@ -0,0 +1,915 @@
+import base64
+import json
+import shutil
+import struct
+import tempfile
+from io import BytesIO
+from unittest import mock
+
+from api.cookable_index import cookable_index
+from api.metrics import metrics_view, registry
+from api.serializers import Base64ImageField
+from api.views import (BATCH_ABSENT, BATCH_ADDED, BATCH_EXISTS,
+                       BATCH_NOT_FOUND, BATCH_REMOVED)
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.http import Http404
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from recipes.images import build_renditions
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, ShoppingCartIngredient, Tag)
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APITestCase
+from users.models import Subscription
+
+User = get_user_model()
+
+
+def make_jpeg(size=(8, 8), padding=0):
+    """
+    Возвращает JPEG, в заголовке которого указан размер size.
+
+    Картинка кодируется размером 8x8, размер в заголовке подменяется.
+    Перед заголовком добавляются служебные сегменты общим размером
+    не меньше padding байт.
+    """
+    buffer = BytesIO()
+    Image.new('RGB', (8, 8), 'red').save(buffer, 'JPEG')
+    data = buffer.getvalue()
+    frame = data.index(b'\xff\xc0') + 5
+    width, height = size
+    data = data[:frame] + struct.pack('>HH', height, width) + data[frame + 4:]
+    segments = b''
+    while len(segments) < padding:
+        segments += b'\xff\xef' + struct.pack('>H', 60002) + bytes(60000)
+    return data[:2] + segments + data[2:]
+
+
+def to_data_uri(data):
+    return 'data:image/jpeg;base64,' + base64.b64encode(data).decode()
+
+
+class FoodgramAPITestCase(APITestCase):
+    """
+    Общие данные для тестов API: авторы, теги, ингредиенты, рецепты.
+
+    Рендишены картинок в фоновом пуле не строятся.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Автор', last_name='Рецептов', password='pass-1234')
+        cls.user = User.objects.create_user(
+            email='user@example.com', username='user',
+            first_name='Читатель', last_name='Рецептов', password='pass-1234')
+        cls.tags = [
+            Tag.objects.create(
+                name=f'Тег {index}', color=f'#00000{index}',
+                slug=f'tag-{index}')
+            for index in range(3)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {index}', measurement_unit='г')
+            for index in range(4)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        submit_renditions = mock.patch('recipes.images._submit')
+        submit_renditions.start()
+        self.addCleanup(submit_renditions.stop)
+
+    def use_temp_media_root(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    @classmethod
+    def create_recipe(cls, name='Рецепт', ingredients=None, author=None):
+        """Создает рецепт с тегами и ингредиентами {ingredient: amount}."""
+        recipe = Recipe.objects.create(
+            author=author or cls.author,
+            name=name,
+            image='recipes/images/recipe.png',
+            text='Описание',
+            cooking_time=10,
+        )
+        if ingredients is None:
+            ingredients = {cls.ingredients[0]: 100, cls.ingredients[1]: 2}
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredients=ingredient,
+                             amount=amount)
+            for ingredient, amount in ingredients.items()
+        )
+        recipe.tags.set(cls.tags[:2])
+        return recipe
+
+
+class RecipeListQueriesTest(FoodgramAPITestCase):
+    """Число SQL-запросов ленты рецептов не зависит от размера страницы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for index in range(30):
+            cls.create_recipe(name=f'Рецепт {index}')
+
+    def get_queries_count(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries), response
+
+    def test_page_size_does_not_change_queries_count(self):
+        small_count, small = self.get_queries_count('/api/recipes/?limit=6')
+        large_count, large = self.get_queries_count('/api/recipes/?limit=30')
+        self.assertEqual(len(small.data['results']), 6)
+        self.assertEqual(len(large.data['results']), 30)
+        self.assertEqual(small_count, large_count)
+
+    def test_authenticated_page_size_does_not_change_queries_count(self):
+        self.client.force_authenticate(self.user)
+        small_count, _ = self.get_queries_count('/api/recipes/?limit=6')
+        large_count, _ = self.get_queries_count('/api/recipes/?limit=30')
+        self.assertEqual(small_count, large_count)
+
+
+class ShoppingCartIngredientTest(FoodgramAPITestCase):
+    """Агрегат корзины совпадает с пересчетом по ее содержимому."""
+
+    def setUp(self):
+        super().setUp()
+        self.first = self.create_recipe(name='Первый')
+        self.second = self.create_recipe(
+            name='Второй',
+            ingredients={self.ingredients[1]: 3, self.ingredients[2]: 5})
+        self.client.force_authenticate(self.user)
+
+    def assertCartConsistent(self, expected):
+        stored = {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount in (
+                ShoppingCartIngredient.objects.values_list(
+                    'user_id', 'ingredient_id', 'amount'))
+        }
+        self.assertEqual(
+            stored, ShoppingCartIngredient.objects.calculate([self.user.id]))
+        self.assertEqual(stored, {
+            (self.user.id, ingredient.id): amount
+            for ingredient, amount in expected.items()
+        })
+
+    def add_to_cart(self, recipe):
+        response = self.client.post(
+            f'/api/recipes/{recipe.id}/shopping_cart/')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_add_and_remove(self):
+        self.add_to_cart(self.first)
+        self.add_to_cart(self.second)
+        self.assertCartConsistent({
+            self.ingredients[0]: 100,
+            self.ingredients[1]: 5,
+            self.ingredients[2]: 5,
+        })
+        response = self.client.delete(
+            f'/api/recipes/{self.first.id}/shopping_cart/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertCartConsistent({
+            self.ingredients[1]: 3,
+            self.ingredients[2]: 5,
+        })
+
+    def test_recipe_update(self):
+        self.add_to_cart(self.first)
+        self.add_to_cart(self.second)
+        self.client.force_authenticate(self.author)
+        response = self.client.patch(
+            f'/api/recipes/{self.first.id}/',
+            {
+                'tags': [self.tags[0].id],
+                'ingredients': [
+                    {'id': self.ingredients[1].id, 'amount': 4},
+                    {'id': self.ingredients[3].id, 'amount': 7},
+                ],
+            },
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertCartConsistent({
+            self.ingredients[1]: 7,
+            self.ingredients[2]: 5,
+            self.ingredients[3]: 7,
+        })
+
+    def test_recipe_delete(self):
+        self.add_to_cart(self.first)
+        self.add_to_cart(self.second)
+        self.client.force_authenticate(self.author)
+        response = self.client.delete(f'/api/recipes/{self.second.id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertCartConsistent({
+            self.ingredients[0]: 100,
+            self.ingredients[1]: 2,
+        })
+
+    def test_clear(self):
+        self.add_to_cart(self.first)
+        self.add_to_cart(self.second)
+        response = self.client.delete('/api/recipes/shopping_cart/clear/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertCartConsistent({})
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.cart_count, 0)
+
+
+class RecipeCursorPaginationTest(FoodgramAPITestCase):
+    """Пагинация ленты по ключу сортировки."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for index in range(7):
+            cls.create_recipe(name=f'Рецепт {index}')
+        cls.expected_ids = list(Recipe.objects.values_list('id', flat=True))
+
+    def get_page(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('count', response.data)
+        return response.data
+
+    def test_forward_and_backward(self):
+        pages = [self.get_page('/api/recipes/?cursor=&limit=3')]
+        self.assertIsNone(pages[0]['previous'])
+        while pages[-1]['next']:
+            pages.append(self.get_page(pages[-1]['next']))
+        self.assertEqual(
+            [len(page['results']) for page in pages], [3, 3, 1])
+        self.assertEqual(
+            [recipe['id'] for page in pages for recipe in page['results']],
+            self.expected_ids)
+        previous = self.get_page(pages[-1]['previous'])
+        self.assertEqual(previous['results'], pages[1]['results'])
+        first = self.get_page(previous['previous'])
+        self.assertEqual(first['results'], pages[0]['results'])
+        self.assertIsNone(first['previous'])
+        self.assertIsNotNone(first['next'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/recipes/?cursor=invalid')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_page_pagination_by_default(self):
+        response = self.client.get('/api/recipes/?limit=3&page=2')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 7)
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data['results']],
+            self.expected_ids[3:6])
+
+
+class RecipeIngredientsUpdateTest(FoodgramAPITestCase):
+    """Обновление ингредиентов рецепта меняет только отличающиеся строки."""
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = self.create_recipe()
+        self.client.force_authenticate(self.author)
+
+    def get_rows(self):
+        return {
+            ingredient_id: (row_id, amount)
+            for row_id, ingredient_id, amount in (
+                RecipeIngredient.objects.filter(recipe=self.recipe)
+                .values_list('id', 'ingredients_id', 'amount'))
+        }
+
+    def patch_ingredients(self, ingredients):
+        response = self.client.patch(
+            f'/api/recipes/{self.recipe.id}/',
+            {
+                'tags': [tag.id for tag in self.tags[:2]],
+                'ingredients': [
+                    {'id': ingredient.id, 'amount': amount}
+                    for ingredient, amount in ingredients.items()
+                ],
+            },
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def test_diff(self):
+        old = self.get_rows()
+        second, third = self.ingredients[1:3]
+        response = self.patch_ingredients({second: 5, third: 1})
+        rows = self.get_rows()
+        self.assertEqual(set(rows), {second.id, third.id})
+        self.assertEqual(rows[second.id], (old[second.id][0], 5))
+        self.assertEqual(rows[third.id][1], 1)
+        self.assertEqual(
+            sorted(
+                (ingredient['id'], ingredient['amount'])
+                for ingredient in response.data['ingredients']),
+            [(second.id, 5), (third.id, 1)])
+
+    def test_unchanged_ingredients_are_not_written(self):
+        old = self.get_rows()
+        table = RecipeIngredient._meta.db_table
+        with CaptureQueriesContext(connection) as queries:
+            self.patch_ingredients({
+                self.ingredients[0]: 100, self.ingredients[1]: 2})
+        self.assertEqual(self.get_rows(), old)
+        self.assertFalse([
+            query['sql'] for query in queries
+            if table in query['sql']
+            and query['sql'].lstrip().upper().startswith(
+                ('INSERT', 'UPDATE', 'DELETE'))
+        ])
+
+
+class ToggleTest(FoodgramAPITestCase):
+    """Добавление и удаление в избранное, корзину и подписки."""
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = self.create_recipe()
+        self.client.force_authenticate(self.user)
+
+    def check_recipe_toggle(self, url, model, counter):
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['id'], self.recipe.id)
+        self.assertEqual(response.data['name'], self.recipe.name)
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            model.objects.filter(user=self.user, recipe=self.recipe).count(),
+            1)
+        self.recipe.refresh_from_db()
+        self.assertEqual(getattr(self.recipe, counter), 1)
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(model.objects.filter(user=self.user).exists())
+        self.recipe.refresh_from_db()
+        self.assertEqual(getattr(self.recipe, counter), 0)
+
+    def test_favorite(self):
+        self.check_recipe_toggle(
+            f'/api/recipes/{self.recipe.id}/favorite/',
+            Favorite, 'favorites_count')
+
+    def test_shopping_cart(self):
+        self.check_recipe_toggle(
+            f'/api/recipes/{self.recipe.id}/shopping_cart/',
+            ShoppingCart, 'cart_count')
+
+    def test_missing_recipe(self):
+        response = self.client.post('/api/recipes/0/favorite/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.delete('/api/recipes/0/favorite/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_subscribe(self):
+        url = f'/api/users/{self.author.id}/subscribe/'
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(response.data['is_subscribed'])
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_count, 1)
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Subscription.objects.exists())
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_count, 0)
+
+    def test_subscribe_to_self(self):
+        response = self.client.post(f'/api/users/{self.user.id}/subscribe/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Subscription.objects.exists())
+
+
+class BatchTest(FoodgramAPITestCase):
+    """Пакетное добавление и удаление рецептов в избранное и корзину."""
+
+    def setUp(self):
+        super().setUp()
+        self.recipes = [
+            self.create_recipe(name=f'Рецепт {index}') for index in range(4)
+        ]
+        self.missing_id = self.recipes[-1].id + 100
+        self.client.force_authenticate(self.user)
+
+    def get_statuses(self, method, url, recipe_ids):
+        response = getattr(self.client, method)(
+            url, {'recipes': recipe_ids}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [
+            (result['id'], result['status'])
+            for result in response.data['results']
+        ]
+
+    def get_counters(self, counter):
+        return list(Recipe.objects.filter(
+            id__in=[recipe.id for recipe in self.recipes]
+        ).order_by('id').values_list(counter, flat=True))
+
+    def check_batch(self, url, model, counter):
+        first, second = self.recipes[:2]
+        self.client.post(f'/api/recipes/{first.id}/{url}/')
+        statuses = self.get_statuses(
+            'post', f'/api/recipes/{url}/',
+            [first.id, second.id, self.missing_id, second.id])
+        self.assertEqual(statuses, [
+            (first.id, BATCH_EXISTS),
+            (second.id, BATCH_ADDED),
+            (self.missing_id, BATCH_NOT_FOUND),
+        ])
+        self.assertEqual(
+            set(model.objects.filter(user=self.user).values_list(
+                'recipe_id', flat=True)),
+            {first.id, second.id})
+        self.assertEqual(self.get_counters(counter), [1, 1, 0, 0])
+        statuses = self.get_statuses(
+            'delete', f'/api/recipes/{url}/',
+            [second.id, self.recipes[2].id, self.missing_id])
+        self.assertEqual(statuses, [
+            (second.id, BATCH_REMOVED),
+            (self.recipes[2].id, BATCH_ABSENT),
+            (self.missing_id, BATCH_NOT_FOUND),
+        ])
+        self.assertEqual(
+            list(model.objects.filter(user=self.user).values_list(
+                'recipe_id', flat=True)),
+            [first.id])
+        self.assertEqual(self.get_counters(counter), [1, 0, 0, 0])
+
+    def test_favorite(self):
+        self.check_batch('favorite', Favorite, 'favorites_count')
+
+    def test_shopping_cart(self):
+        self.check_batch('shopping_cart', ShoppingCart, 'cart_count')
+        self.assertEqual(
+            {
+                (user_id, ingredient_id): amount
+                for user_id, ingredient_id, amount in (
+                    ShoppingCartIngredient.objects.values_list(
+                        'user_id', 'ingredient_id', 'amount'))
+            },
+            ShoppingCartIngredient.objects.calculate([self.user.id]))
+
+    def test_queries_count_does_not_depend_on_batch_size(self):
+        counts = []
+        for recipes in (self.recipes[:1], self.recipes[1:]):
+            with CaptureQueriesContext(connection) as queries:
+                self.get_statuses(
+                    'post', '/api/recipes/shopping_cart/',
+                    [recipe.id for recipe in recipes])
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_empty_batch(self):
+        response = self.client.post(
+            '/api/recipes/favorite/', {'recipes': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RecipeImageTest(FoodgramAPITestCase):
+    """Проверка загружаемых картинок и ссылки на их уменьшенные копии."""
+
+    def setUp(self):
+        super().setUp()
+        self.use_temp_media_root()
+        self.client.force_authenticate(self.author)
+
+    def create(self, image):
+        return self.client.post(
+            '/api/recipes/',
+            {
+                'tags': [self.tags[0].id],
+                'ingredients': [{'id': self.ingredients[0].id, 'amount': 1}],
+                'name': 'С картинкой',
+                'image': image,
+                'text': 'Описание',
+                'cooking_time': 5,
+            },
+            format='json',
+        )
+
+    def assertImageRejected(self, response, message):
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn(message, str(response.data['image']))
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_too_many_pixels_in_header(self):
+        self.assertImageRejected(
+            self.create(to_data_uri(make_jpeg((6000, 6000)))), 'Разрешение')
+
+    def test_too_many_pixels_after_large_metadata(self):
+        self.assertImageRejected(
+            self.create(to_data_uri(make_jpeg((6000, 6000), 130_000))),
+            'Разрешение')
+
+    def test_unreadable_image(self):
+        self.assertImageRejected(
+            self.create(to_data_uri(bytes(1024))), 'определить разрешение')
+
+    def test_uploaded_file_pixels(self):
+        image = SimpleUploadedFile(
+            'recipe.jpg', make_jpeg((6000, 6000)), 'image/jpeg')
+        with self.assertRaisesMessage(ValidationError, 'Разрешение'):
+            Base64ImageField().run_validation(image)
+
+    def get_rendition_urls(self):
+        recipe = self.client.get('/api/recipes/').data['results'][0]
+        return recipe['image'], {
+            url
+            for formats in recipe['image_renditions'].values()
+            for url in formats.values()
+        }
+
+    def test_renditions_fall_back_to_original(self):
+        response = self.create(to_data_uri(make_jpeg(padding=130_000)))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        image, urls = self.get_rendition_urls()
+        self.assertEqual(urls, {image})
+        with self.captureOnCommitCallbacks(execute=True):
+            build_renditions(Recipe.objects.get().image.name)
+        image, urls = self.get_rendition_urls()
+        self.assertEqual(len(urls), 4)
+        self.assertNotIn(image, urls)
+
+
+@override_settings(METRICS_ENABLED=True)
+class MetricsTest(FoodgramAPITestCase):
+    """Метрики запросов: время сериализации учитывается отдельно."""
+
+    def setUp(self):
+        super().setUp()
+        self.create_recipe()
+
+    def get_totals(self, metric):
+        prefix = f'{metric}{{view="RecipeViewSet",action="list"}} '
+        for line in registry.export().splitlines():
+            if line.startswith(prefix):
+                return float(line[len(prefix):])
+        return 0.0
+
+    def test_serialize_time(self):
+        serialize_before = self.get_totals('api_serialize_seconds_total')
+        render_before = self.get_totals('api_render_seconds_total')
+        response = self.client.get('/api/recipes/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertRegex(
+            response['Server-Timing'],
+            r'serialize;dur=[\d.]+, render;dur=[\d.]+')
+        self.assertGreater(
+            self.get_totals('api_serialize_seconds_total'), serialize_before)
+        self.assertGreater(
+            self.get_totals('api_render_seconds_total'), render_before)
+
+    def test_metrics_hidden_from_other_addresses(self):
+        request = RequestFactory().get('/metrics', REMOTE_ADDR='10.0.0.5')
+        request.user = AnonymousUser()
+        with self.assertRaises(Http404):
+            metrics_view(request)
+        request.META['REMOTE_ADDR'] = '127.0.0.1'
+        self.assertEqual(
+            metrics_view(request).status_code, status.HTTP_200_OK)
+
+
+class CookableIndexTest(FoodgramAPITestCase):
+    """Индекс подбора рецептов обновляется по измененным рецептам."""
+
+    def setUp(self):
+        super().setUp()
+        first, second, third, _ = self.ingredients
+        with self.captureOnCommitCallbacks(execute=True):
+            self.first = self.create_recipe(
+                name='Первый', ingredients={first: 1, second: 1})
+            self.second = self.create_recipe(
+                name='Второй', ingredients={second: 1, third: 1})
+
+    def get_coverage(self, *ingredients):
+        ids = ','.join(str(ingredient.id) for ingredient in ingredients)
+        response = self.client.get(f'/api/recipes/cookable/?ingredients={ids}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return {
+            recipe['id']: (
+                recipe['matched_count'],
+                recipe['total_count'],
+                [ingredient['id'] for ingredient in (
+                    recipe['missing_ingredients'])],
+            )
+            for recipe in response.data['results']
+        }
+
+    def test_update_reads_only_changed_recipes(self):
+        first, second, third, fourth = self.ingredients
+        self.assertEqual(self.get_coverage(second), {
+            self.first.id: (1, 2, [first.id]),
+            self.second.id: (1, 2, [third.id]),
+        })
+        self.client.force_authenticate(self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                f'/api/recipes/{self.first.id}/',
+                {
+                    'tags': [self.tags[0].id],
+                    'ingredients': [
+                        {'id': third.id, 'amount': 1},
+                        {'id': fourth.id, 'amount': 1},
+                    ],
+                },
+                format='json',
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        table = RecipeIngredient._meta.db_table
+        with CaptureQueriesContext(connection) as queries:
+            coverage = self.get_coverage(third)
+        self.assertEqual(coverage, {
+            self.first.id: (1, 2, [fourth.id]),
+            self.second.id: (1, 2, [second.id]),
+        })
+        self.assertTrue(all(
+            'WHERE' in query['sql']
+            for query in queries if table in query['sql']))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/recipes/{self.second.id}/')
+        self.assertEqual(self.get_coverage(third), {
+            self.first.id: (1, 2, [fourth.id]),
+        })
+        self.assertEqual(self.get_coverage(second), {})
+
+    def test_snapshot_is_not_changed_by_updates(self):
+        snapshot = cookable_index.snapshot()
+        first_id = self.first.id
+        with self.captureOnCommitCallbacks(execute=True):
+            self.first.delete()
+        self.assertEqual(
+            [recipe_id for recipe_id, _, _ in snapshot.match(
+                [self.ingredients[1].id])],
+            [self.second.id, first_id])
+        self.assertEqual(
+            [recipe_id for recipe_id, _, _ in (
+                cookable_index.snapshot().match([self.ingredients[1].id]))],
+            [self.second.id])
+
+
+class RecipeFeedCacheTest(FoodgramAPITestCase):
+    """Изменения данных сбрасывают закэшированную ленту рецептов."""
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = self.create_recipe()
+
+    def get_feed(self, user=None):
+        self.client.force_authenticate(user)
+        response = self.client.get('/api/recipes/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['results']
+
+    def test_recipe_update(self):
+        self.get_feed()
+        self.client.force_authenticate(self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                f'/api/recipes/{self.recipe.id}/',
+                {
+                    'name': 'Новое название',
+                    'tags': [self.tags[0].id],
+                    'ingredients': [
+                        {'id': self.ingredients[0].id, 'amount': 100}],
+                },
+                format='json',
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        recipe = self.get_feed()[0]
+        self.assertEqual(recipe['name'], 'Новое название')
+        self.assertEqual(
+            [tag['id'] for tag in recipe['tags']], [self.tags[0].id])
+
+    def test_tag_change(self):
+        self.get_feed()
+        tag = self.tags[0]
+        tag.name = 'Переименованный тег'
+        with self.captureOnCommitCallbacks(execute=True):
+            tag.save()
+        self.assertIn(
+            'Переименованный тег',
+            [tag['name'] for tag in self.get_feed()[0]['tags']])
+
+    def test_ingredient_change(self):
+        self.get_feed()
+        ingredient = self.ingredients[0]
+        ingredient.name = 'Переименованный ингредиент'
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient.save()
+        self.assertIn(
+            'Переименованный ингредиент',
+            [ingredient['name']
+             for ingredient in self.get_feed()[0]['ingredients']])
+
+    def test_author_rename(self):
+        self.get_feed()
+        self.author.refresh_from_db()
+        self.author.first_name = 'Переименованный'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.save()
+        self.assertEqual(
+            self.get_feed()[0]['author']['first_name'], 'Переименованный')
+
+    def test_import(self):
+        self.use_temp_media_root()
+        self.get_feed()
+        admin = User.objects.create_user(
+            email='admin@example.com', username='admin', first_name='Админ',
+            last_name='Админ', password='pass-1234', is_staff=True)
+        record = {
+            'name': 'Импортированный',
+            'text': 'Описание',
+            'cooking_time': 5,
+            'tags': [self.tags[0].slug],
+            'ingredients': [{
+                'name': self.ingredients[0].name,
+                'measurement_unit': self.ingredients[0].measurement_unit,
+                'amount': 1,
+            }],
+            'image': to_data_uri(make_jpeg()),
+        }
+        file = SimpleUploadedFile(
+            'recipes.ndjson', json.dumps(record).encode(),
+            'application/x-ndjson')
+        self.client.force_authenticate(admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/api/recipes/import/', {'file': file}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            [recipe['name'] for recipe in self.get_feed()],
+            ['Импортированный', self.recipe.name])
+
+    def test_user_fields_on_cached_page(self):
+        self.get_feed()
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/recipes/{self.recipe.id}/favorite/')
+            self.client.post(f'/api/recipes/{self.recipe.id}/shopping_cart/')
+        recipe = self.get_feed(self.user)[0]
+        self.assertTrue(recipe['is_favorited'])
+        self.assertTrue(recipe['is_in_shopping_cart'])
+        for user in (None, self.author):
+            recipe = self.get_feed(user)[0]
+            self.assertFalse(recipe['is_favorited'])
+            self.assertFalse(recipe['is_in_shopping_cart'])
+
+
+class RecipeConditionalRequestTest(FoodgramAPITestCase):
+    """Условные запросы к рецепту и ленте."""
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = self.create_recipe()
+        self.url = f'/api/recipes/{self.recipe.id}/'
+
+    def get(self, url, status_code=status.HTTP_200_OK, **headers):
+        response = self.client.get(url, **headers)
+        self.assertEqual(response.status_code, status_code)
+        return response
+
+    def test_detail_not_modified(self):
+        with self.assertNumQueries(3):
+            response = self.get(self.url)
+        self.assertEqual(response.data['id'], self.recipe.id)
+        with self.assertNumQueries(1):
+            self.get(
+                self.url, status.HTTP_304_NOT_MODIFIED,
+                HTTP_IF_NONE_MATCH=response['ETag'])
+        self.get(
+            self.url, status.HTTP_304_NOT_MODIFIED,
+            HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+
+    def test_detail_etag_changes_on_update(self):
+        etag = self.get(self.url)['ETag']
+        self.client.force_authenticate(self.author)
+        author_etag = self.get(self.url)['ETag']
+        response = self.client.patch(
+            self.url,
+            {
+                'name': 'Новое название',
+                'tags': [self.tags[0].id],
+                'ingredients': [{'id': self.ingredients[0].id, 'amount': 1}],
+            },
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.get(self.url, HTTP_IF_NONE_MATCH=author_etag)
+        self.assertEqual(response.data['name'], 'Новое название')
+        self.client.force_authenticate(None)
+        self.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_detail_etag_changes_on_tag_edit(self):
+        etag = self.get(self.url)['ETag']
+        tag = self.tags[0]
+        tag.name = 'Переименованный тег'
+        tag.save()
+        self.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_detail_etag_changes_on_toggle(self):
+        self.client.force_authenticate(self.user)
+        etag = self.get(self.url)['ETag']
+        for action in ('favorite', 'shopping_cart'):
+            self.client.post(f'{self.url}{action}/')
+            response = self.get(self.url, HTTP_IF_NONE_MATCH=etag)
+            etag = response['ETag']
+        self.assertTrue(response.data['is_favorited'])
+        self.assertTrue(response.data['is_in_shopping_cart'])
+        self.get(self.url, status.HTTP_304_NOT_MODIFIED,
+                 HTTP_IF_NONE_MATCH=etag)
+
+    def test_list_not_modified(self):
+        etag = self.get('/api/recipes/')['ETag']
+        with self.assertNumQueries(0):
+            self.get('/api/recipes/', status.HTTP_304_NOT_MODIFIED,
+                     HTTP_IF_NONE_MATCH=etag)
+        self.client.force_authenticate(self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(
+                self.url,
+                {
+                    'name': 'Новое название',
+                    'tags': [self.tags[0].id],
+                    'ingredients': [
+                        {'id': self.ingredients[0].id, 'amount': 1}],
+                },
+                format='json',
+            )
+        self.client.force_authenticate(None)
+        response = self.get('/api/recipes/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.data['results'][0]['name'], 'Новое название')
+
+    def test_list_etag_changes_on_toggle(self):
+        self.client.force_authenticate(self.user)
+        etag = self.get('/api/recipes/')['ETag']
+        self.get('/api/recipes/', status.HTTP_304_NOT_MODIFIED,
+                 HTTP_IF_NONE_MATCH=etag)
+        self.client.post(f'{self.url}favorite/')
+        response = self.get('/api/recipes/', HTTP_IF_NONE_MATCH=etag)
+        self.assertTrue(response.data['results'][0]['is_favorited'])
+
+
+class CachedTokenAuthenticationTest(FoodgramAPITestCase):
+    """Закэшированный токен перестает действовать после выхода и отключения."""
+
+    def setUp(self):
+        super().setUp()
+        response = self.client.post(
+            '/api/auth/token/login/',
+            {'email': self.user.email, 'password': 'pass-1234'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {response.data["auth_token"]}')
+
+    def get_me(self, status_code):
+        response = self.client.get('/api/users/me/')
+        self.assertEqual(response.status_code, status_code)
+        return response
+
+    def test_token_is_cached(self):
+        self.get_me(status.HTTP_200_OK)
+        # Единственный запрос - is_subscribed сериализатора пользователя.
+        with self.assertNumQueries(1):
+            response = self.get_me(status.HTTP_200_OK)
+        self.assertEqual(response.data['email'], self.user.email)
+
+    def test_logout(self):
+        self.get_me(status.HTTP_200_OK)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.get_me(status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivation(self):
+        self.get_me(status.HTTP_200_OK)
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.get_me(status.HTTP_401_UNAUTHORIZED)
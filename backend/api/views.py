@@ -1,36 +1,77 @@
-from datetime import datetime
+from copy import deepcopy
+from functools import partial
 
-from api.filters import IngredientSearchFilter, RecipeFilter
+from api.cache import (COUNTER_CACHE_TIMEOUT, INGREDIENTS, RECIPES,
+                       RESPONSE_CACHE_TIMEOUT, TAGS, CachedReferenceMixin,
+                       get_etag, get_recipe_feed_key)
+from api.cookable_index import cookable_index
+from api.filters import (COUNTER_ORDERING_FIELDS, RecipeFilter,
+                         RecipeOrderingFilter, RecipeSearchFilter)
+from api.ingredient_index import ingredient_index
 from api.pagination import FoodgramPagination
 from api.permissions import IsAuthorOrReadOnly
-from api.serializers import (FavoriteSerializer, IngredientSerializer,
-                             RecipeGetSerializer, RecipeSerializer,
-                             ShoppingCartDownloadSerializer,
-                             ShoppingCartSerializer, SubscriptionSerializer,
-                             TagSerializer)
+from api.recipe_transfer import (RecipeImporter, export_ndjson, export_zip,
+                                 get_export_queryset, read_records)
+from api.relations import insert_ignore
+from api.renderers import (RECIPE_EXPORT_RENDERERS, SHOPPING_LIST_RENDERERS,
+                           StreamingRenderer)
+from api.serializers import (CookableQuerySerializer, CookableRecipeSerializer,
+                             IngredientSerializer, MiniRecipeSerializer,
+                             RecipeBatchSerializer, RecipeGetSerializer,
+                             RecipeSerializer, ShoppingCartDownloadSerializer,
+                             SubscriptionSerializer, TagSerializer)
+from api.shopping_list import export_shopping_list
 from django.contrib.auth import get_user_model
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import (BooleanField, Exists, F, OuterRef, Prefetch,
+                              Value, prefetch_related_objects)
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
+from recipes.counters import change_counter, recount
 from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
-                            ShoppingCart, Tag)
-from rest_framework import permissions, status, viewsets
+                            ShoppingCart, ShoppingCartIngredient, Tag)
+from rest_framework import generics, permissions, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import MultiPartParser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from users.models import Subscription
 
 User = get_user_model()
 
+USER_FILTERS = ('is_favorited', 'is_in_shopping_cart')
+BATCH_ADDED = 'added'
+BATCH_EXISTS = 'exists'
+BATCH_REMOVED = 'removed'
+BATCH_ABSENT = 'absent'
+BATCH_NOT_FOUND = 'not_found'
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+
+class IngredientViewSet(CachedReferenceMixin, viewsets.ReadOnlyModelViewSet):
     """Вьюсет для ингредиентов."""
 
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
-    filter_backends = (IngredientSearchFilter,)
-    search_fields = ('^name',)
+    authentication_classes = ()
+    cache_namespace = INGREDIENTS
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            request, partial(self.get_index_response, request))
+
+    def get_index_response(self, request):
+        name = request.query_params.get('name')
+        if name:
+            return Response(ingredient_index.search(name))
+        return Response(ingredient_index.all())
 
 
 class RecipeViewSet(viewsets.ModelViewSet):
@@ -40,8 +81,151 @@ class RecipeViewSet(viewsets.ModelViewSet):
     serializer_class = RecipeGetSerializer
     permission_classes = (IsAuthorOrReadOnly,)
     pagination_class = FoodgramPagination
-    filter_backends = (DjangoFilterBackend,)
-    filter_class = RecipeFilter
+    lookup_value_regex = r'\d+'
+    filter_backends = (
+        DjangoFilterBackend, RecipeSearchFilter, RecipeOrderingFilter)
+    filterset_class = RecipeFilter
+    ordering_fields = ('pub_date', *COUNTER_ORDERING_FIELDS)
+
+    def get_queryset(self):
+        user = self.request.user
+        queryset = Recipe.objects.select_related('author').prefetch_related(
+            *self.get_prefetches()).defer('search_document')
+        if user.is_anonymous:
+            return queryset.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField()),
+            )
+        return queryset.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+        )
+
+    def get_prefetches(self):
+        return (
+            'tags',
+            Prefetch(
+                'recipe_ingredients',
+                queryset=RecipeIngredient.objects.select_related('ingredients')
+            ),
+        )
+
+    def get_cursor_ordering(self):
+        return RecipeOrderingFilter().get_ordering(
+            self.request, None, self) or Recipe._meta.ordering
+
+    def list(self, request, *args, **kwargs):
+        """
+        Отдает ленту рецептов из кэша.
+
+        В кэше хранятся страницы без пользовательских полей, которые
+        заполняются после чтения из кэша. Фильтры по избранному и корзине
+        зависят от пользователя, такие запросы выполняются без кэша.
+        Счетчики не меняют версию рецептов, поэтому страницы,
+        отсортированные по ним, кэшируются ненадолго.
+
+        ETag строится из ключа кэша и, для авторизованных пользователей,
+        пользовательских полей страницы: анонимному клиенту ответ 304
+        отдается до чтения кэша.
+        """
+        user = request.user
+        if user.is_authenticated and any(
+                name in request.query_params for name in USER_FILTERS):
+            return super().list(request, *args, **kwargs)
+        key = get_recipe_feed_key(request)
+        etag_parts = (key, request.accepted_renderer.media_type)
+        if user.is_anonymous:
+            not_modified = self.get_not_modified_response(
+                request, get_etag(*etag_parts))
+            if not_modified is not None:
+                return not_modified
+        data = cache.get(key)
+        if data is None:
+            response = super().list(request, *args, **kwargs)
+            data = deepcopy(response.data)
+            self.fill_user_fields(data['results'], AnonymousUser())
+            ordering = request.query_params.get('ordering', '')
+            cache.set(key, data, (
+                COUNTER_CACHE_TIMEOUT
+                if any(field in ordering for field in COUNTER_ORDERING_FIELDS)
+                else RESPONSE_CACHE_TIMEOUT))
+        else:
+            self.fill_user_fields(data['results'], user)
+            response = Response(data)
+        if user.is_authenticated:
+            etag_parts += (''.join(
+                f'{recipe["is_favorited"]:d}{recipe["is_in_shopping_cart"]:d}'
+                for recipe in response.data['results']
+            ),)
+            not_modified = self.get_not_modified_response(
+                request, get_etag(*etag_parts))
+            if not_modified is not None:
+                return not_modified
+        return self.set_validators(response, get_etag(*etag_parts))
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Отдает рецепт с поддержкой условных запросов.
+
+        Рецепт с автором и пользовательскими полями читается одним
+        запросом без связанных записей. Если дата изменения и
+        пользовательские поля совпадают с If-None-Match (или, для
+        анонимных пользователей, с If-Modified-Since), ответ 304
+        отдается без загрузки тегов, ингредиентов и сериализации; иначе
+        связанные записи догружаются к уже прочитанному рецепту.
+        """
+        instance = generics.get_object_or_404(
+            self.filter_queryset(self.get_queryset()).prefetch_related(None),
+            pk=kwargs['pk'],
+        )
+        self.check_object_permissions(request, instance)
+        etag = get_etag(
+            RECIPES, str(instance.pk), instance.updated_at.isoformat(),
+            f'{instance.is_favorited:d}{instance.is_in_shopping_cart:d}',
+            request.accepted_renderer.media_type)
+        last_modified = None
+        if request.user.is_anonymous:
+            last_modified = int(instance.updated_at.timestamp())
+        not_modified = self.get_not_modified_response(
+            request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
+        prefetch_related_objects((instance,), *self.get_prefetches())
+        serializer = self.get_serializer(instance)
+        return self.set_validators(
+            Response(serializer.data), etag, last_modified)
+
+    def get_not_modified_response(self, request, etag, last_modified=None):
+        """Возвращает ответ 304 (412), если сработали условия запроса."""
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            return None
+        return self.set_validators(response, etag, last_modified)
+
+    def set_validators(self, response, etag, last_modified=None):
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        patch_vary_headers(response, ('Accept', 'Authorization'))
+        return response
+
+    def fill_user_fields(self, recipes, user):
+        """Заполняет поля рецептов, зависящие от пользователя."""
+        favorited = in_shopping_cart = set()
+        if user.is_authenticated:
+            recipe_ids = [recipe['id'] for recipe in recipes]
+            favorited = set(Favorite.objects.filter(
+                user=user, recipe_id__in=recipe_ids
+            ).values_list('recipe_id', flat=True))
+            in_shopping_cart = set(ShoppingCart.objects.filter(
+                user=user, recipe_id__in=recipe_ids
+            ).values_list('recipe_id', flat=True))
+        for recipe in recipes:
+            recipe['is_favorited'] = recipe['id'] in favorited
+            recipe['is_in_shopping_cart'] = recipe['id'] in in_shopping_cart
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
@@ -51,81 +235,280 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return RecipeGetSerializer
         return RecipeSerializer
 
-    def perform_action(self, serializer_class, user, pk):
-        serializer = serializer_class(
-            data={'user': user.id, 'recipe': pk},
-            context={'request': self.request}
-        )
-        serializer.is_valid(raise_exception=True)
-        serializer.save()
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+    def add_recipe(self, model, user, pk):
+        """
+        Добавляет рецепт в избранное или корзину пользователя.
+
+        Повтор определяется по уникальному ограничению: вставка без
+        конфликтов выполняется одним запросом.
+        """
+        try:
+            recipe = Recipe.objects.only(
+                'id', 'name', 'image', 'cooking_time').get(id=pk)
+        except Recipe.DoesNotExist:
+            raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [
+                'Данного рецепта не существует!']})
+        if not insert_ignore(
+                model, ('user', 'recipe'), ((user.id, recipe.id),)):
+            raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [
+                'Рецепт уже добавлен.']})
+        return Response(
+            MiniRecipeSerializer(recipe).data, status=status.HTTP_201_CREATED)
 
     @action(methods=('POST', 'DELETE'), detail=True)
+    @transaction.atomic
     def favorite(self, request, pk):
         if request.method == 'POST':
-            return self.perform_action(FavoriteSerializer, request.user, pk)
+            response = self.add_recipe(Favorite, request.user, pk)
+            change_counter(Recipe, pk, 'favorites_count', 1)
+            return response
         if request.method == 'DELETE':
-            return self.delete_recipe(Favorite, request.user, pk)
+            response = self.delete_recipe(Favorite, request.user, pk)
+            if response.status_code == status.HTTP_204_NO_CONTENT:
+                change_counter(Recipe, pk, 'favorites_count', -1)
+            return response
         return None
 
     @action(methods=('POST', 'DELETE'), detail=True)
+    @transaction.atomic
     def shopping_cart(self, request, pk):
         if request.method == 'POST':
-            return self.perform_action(
-                ShoppingCartSerializer, request.user, pk)
+            response = self.add_recipe(ShoppingCart, request.user, pk)
+            ShoppingCartIngredient.objects.add_recipe(request.user, pk)
+            change_counter(Recipe, pk, 'cart_count', 1)
+            return response
         if request.method == 'DELETE':
-            return self.delete_recipe(ShoppingCart, request.user, pk)
+            response = self.delete_recipe(ShoppingCart, request.user, pk)
+            if response.status_code == status.HTTP_204_NO_CONTENT:
+                ShoppingCartIngredient.objects.remove_recipe(
+                    request.user, pk)
+                change_counter(Recipe, pk, 'cart_count', -1)
+            return response
         return None
 
-    @action(detail=False, methods=('get',),
+    def change_recipes(self, model, counter):
+        """
+        Добавляет или убирает несколько рецептов одним запросом.
+
+        Рецепты и их наличие у пользователя читаются одним запросом,
+        изменения вносятся одним INSERT или DELETE, счетчики затронутых
+        рецептов пересчитываются одним UPDATE. Возвращает ответ с
+        результатом для каждого id, id измененных рецептов и признак того,
+        что база изменилась ровно так, как ожидалось (иначе параллельный
+        запрос успел изменить те же строки).
+        """
+        serializer = RecipeBatchSerializer(data=self.request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = serializer.validated_data['recipes']
+        user = self.request.user
+        added = dict(Recipe.objects.filter(id__in=recipe_ids).annotate(
+            added=Exists(model.objects.filter(
+                user=user, recipe=OuterRef('pk')))
+        ).order_by().values_list('id', 'added'))
+        if self.request.method == 'POST':
+            changed = [
+                recipe_id for recipe_id in recipe_ids
+                if added.get(recipe_id) is False
+            ]
+            count = insert_ignore(
+                model, ('user', 'recipe'),
+                [(user.id, recipe_id) for recipe_id in changed])
+            done, skipped = BATCH_ADDED, BATCH_EXISTS
+        else:
+            changed = [
+                recipe_id for recipe_id in recipe_ids if added.get(recipe_id)
+            ]
+            count = model.objects.filter(
+                user=user, recipe_id__in=changed).delete()[0]
+            done, skipped = BATCH_REMOVED, BATCH_ABSENT
+        recount(Recipe, changed, counter)
+        results = [
+            {
+                'id': recipe_id,
+                'status': (
+                    BATCH_NOT_FOUND if recipe_id not in added
+                    else done if recipe_id in changed else skipped),
+            }
+            for recipe_id in recipe_ids
+        ]
+        return (
+            Response({'results': results}), changed, count == len(changed))
+
+    @action(methods=('POST', 'DELETE'), detail=False, url_path='favorite',
+            url_name='favorite-batch')
+    @transaction.atomic
+    def favorite_batch(self, request):
+        response, _, _ = self.change_recipes(Favorite, 'favorites_count')
+        return response
+
+    @action(methods=('POST', 'DELETE'), detail=False,
+            url_path='shopping_cart', url_name='shopping-cart-batch')
+    @transaction.atomic
+    def shopping_cart_batch(self, request):
+        response, changed, exact = self.change_recipes(
+            ShoppingCart, 'cart_count')
+        if not exact:
+            ShoppingCartIngredient.objects.rebuild((request.user.id,))
+        elif request.method == 'POST':
+            ShoppingCartIngredient.objects.add_recipes(request.user, changed)
+        else:
+            ShoppingCartIngredient.objects.remove_recipes(
+                request.user, changed)
+        return response
+
+    @action(methods=('DELETE',), detail=False, url_path='shopping_cart/clear',
             permission_classes=(permissions.IsAuthenticated,))
+    @transaction.atomic
+    def clear_shopping_cart(self, request):
+        """Очищает корзину покупок одним DELETE."""
+        recipe_ids = list(ShoppingCart.objects.filter(
+            user=request.user).values_list('recipe_id', flat=True))
+        ShoppingCart.objects.filter(user=request.user).delete()
+        ShoppingCartIngredient.objects.filter(user=request.user).delete()
+        recount(Recipe, recipe_ids, 'cart_count')
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=False, methods=('get',))
+    def cookable(self, request):
+        """
+        Подбирает рецепты по имеющимся ингредиентам.
+
+        Ингредиенты передаются параметром ingredients (id через запятую
+        или повтором параметра); max_missing ограничивает число
+        недостающих ингредиентов.
+        """
+        params = {'ingredients': [
+            value
+            for values in request.query_params.getlist('ingredients')
+            for value in values.split(',') if value
+        ]}
+        if 'max_missing' in request.query_params:
+            params['max_missing'] = request.query_params['max_missing']
+        serializer = CookableQuerySerializer(data=params)
+        serializer.is_valid(raise_exception=True)
+        ingredient_ids = serializer.validated_data['ingredients']
+        index = cookable_index.snapshot()
+        matches = index.match(
+            ingredient_ids, serializer.validated_data.get('max_missing'))
+        page = self.paginate_queryset(matches)
+        recipe_ids = [recipe_id for recipe_id, _, _ in page]
+        recipes = Recipe.objects.only(
+            'id', 'name', 'image', 'cooking_time').in_bulk(recipe_ids)
+        missing = index.get_missing(recipe_ids, ingredient_ids)
+        ingredients = Ingredient.objects.in_bulk({
+            ingredient_id
+            for ingredient_ids in missing.values()
+            for ingredient_id in ingredient_ids
+        })
+        results = []
+        for recipe_id, matched, total in page:
+            recipe = recipes.get(recipe_id)
+            if recipe is None:
+                continue
+            recipe.matched_count = matched
+            recipe.total_count = total
+            recipe.missing_ingredients = [
+                ingredients[ingredient_id]
+                for ingredient_id in missing[recipe_id]
+                if ingredient_id in ingredients
+            ]
+            results.append(recipe)
+        serializer = CookableRecipeSerializer(
+            results, many=True, context={'request': request})
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=('get',),
+            permission_classes=(permissions.IsAuthenticated,),
+            renderer_classes=SHOPPING_LIST_RENDERERS)
     def download_shopping_cart(self, request):
         serializer = ShoppingCartDownloadSerializer(
             data={'user': request.user.id},
             context={'request': request})
         serializer.is_valid(raise_exception=True)
         user = request.user
-        ingredients = RecipeIngredient.objects.filter(
-            recipe__shopping_cart__user=request.user
+        ingredients = ShoppingCartIngredient.objects.filter(
+            user=user
         ).values(
-            'ingredients__name',
-            'ingredients__measurement_unit'
-        ).annotate(amount=Sum('amount'))
-
-        today = datetime.today()
-        user_full_name = user.get_full_name()
-        shopping_list = f'Список покупок для {user_full_name}\n\n'
-        shopping_list += f'Дата: {today:%Y-%m-%d}\n\n'
-        shopping_list += '\n'.join((
-            f'- {ingredient["ingredients__name"]} '
-            f'({ingredient["ingredients__measurement_unit"]})'
-            f' - {ingredient["amount"]}'
-            for ingredient in ingredients
-        ))
-        shopping_list += f'\n\nFoodgram ({today:%Y})'
-
-        filename = f'{user.username}_shopping_list.txt'
-        response = HttpResponse(shopping_list, content_type='text/plain')
+            'amount',
+            name=F('ingredient__name'),
+            measurement_unit=F('ingredient__measurement_unit'),
+        ).order_by('name')
+
+        renderer = request.accepted_renderer
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type += f'; charset={renderer.charset}'
+        response = StreamingHttpResponse(
+            export_shopping_list(
+                renderer.format, ingredients.iterator(), user),
+            content_type=content_type,
+        )
+        filename = f'{user.username}_shopping_list.{renderer.format}'
         response['Content-Disposition'] = f'attachment; filename={filename}'
 
         return response
 
+    @action(detail=False, methods=('post',), url_path='import',
+            permission_classes=(permissions.IsAdminUser,),
+            parser_classes=(MultiPartParser,))
+    def import_recipes(self, request):
+        file = request.FILES.get('file')
+        if file is None:
+            return Response(
+                {'file': ['Файл не передан.']},
+                status=status.HTTP_400_BAD_REQUEST)
+        created, errors = RecipeImporter(author=request.user).run(
+            read_records(file))
+        return Response(
+            {'created': created, 'errors': errors},
+            status=(status.HTTP_201_CREATED if created
+                    else status.HTTP_400_BAD_REQUEST))
+
+    @action(detail=False, methods=('get',), url_path='export',
+            permission_classes=(permissions.IsAdminUser,),
+            renderer_classes=RECIPE_EXPORT_RENDERERS)
+    def export_recipes(self, request):
+        renderer = request.accepted_renderer
+        exporter = export_zip if renderer.format == 'zip' else export_ndjson
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type += f'; charset={renderer.charset}'
+        response = StreamingHttpResponse(
+            exporter(get_export_queryset()), content_type=content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename=recipes.{renderer.format}')
+        return response
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs)
+        if getattr(response, 'exception', False) and isinstance(
+                response.accepted_renderer, StreamingRenderer):
+            response.accepted_renderer = JSONRenderer()
+            response.accepted_media_type = JSONRenderer.media_type
+        return response
+
     def delete_recipe(self, model, user, pk):
-        recipe = get_object_or_404(Recipe, id=pk)
-        obj = model.objects.filter(user=user, recipe=recipe)
-        if obj.exists():
-            obj.delete()
+        """
+        Убирает рецепт из избранного или корзины одним DELETE.
+
+        Наличие рецепта проверяется только если удалять было нечего.
+        """
+        if model.objects.filter(user=user, recipe_id=pk).delete()[0]:
             return Response(status=status.HTTP_204_NO_CONTENT)
+        get_object_or_404(Recipe.objects.only('id'), id=pk)
         return Response({
             'errors': 'Рецепт уже удален'
         }, status=status.HTTP_400_BAD_REQUEST)
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(CachedReferenceMixin, viewsets.ReadOnlyModelViewSet):
     """Вьюсет для тегов."""
 
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
+    authentication_classes = ()
+    cache_namespace = TAGS
 
 
 class UserViewSet(UserViewSet):
@@ -133,6 +516,21 @@ class UserViewSet(UserViewSet):
 
     queryset = User.objects.all()
     pagination_class = FoodgramPagination
+    lookup_value_regex = r'\d+'
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        user = self.request.user
+        if user.is_anonymous:
+            return queryset.annotate(
+                is_subscribed=Value(False, output_field=BooleanField()))
+        return queryset.annotate(is_subscribed=Exists(
+            Subscription.objects.filter(user=user, following=OuterRef('pk'))))
+
+    def get_cursor_ordering(self):
+        if self.action == 'subscriptions':
+            return ('-subscription_id',)
+        return ('-date_joined', '-id')
 
     def get_permissions(self):
         if self.action == 'me':
@@ -145,24 +543,41 @@ class UserViewSet(UserViewSet):
         methods=('post', 'delete',),
         permission_classes=(permissions.IsAuthenticated,)
     )
+    @transaction.atomic
     def subscribe(self, request, **kwargs):
+        """
+        Подписка на автора и отписка от него.
+
+        Повторная подписка отсекается уникальным ограничением, отписка
+        выполняется одним DELETE; автор загружается только для ответа
+        на подписку и для сообщения об ошибке.
+        """
         user = self.request.user
-        following_id = self.kwargs.get('id')
-        following = get_object_or_404(User, id=following_id)
-        serializer = SubscriptionSerializer(following,
-                                            data=request.data,
-                                            context={'request': request})
-        serializer.is_valid(raise_exception=True)
+        following_id = int(self.kwargs.get('id'))
 
         if request.method == 'POST':
-            Subscription.objects.create(user=user, following=following)
+            following = get_object_or_404(User, id=following_id)
+            if following.id == user.id:
+                raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [
+                    'Вы не можете подписаться на самого себя!']})
+            if not insert_ignore(
+                    Subscription, ('user', 'following'),
+                    ((user.id, following.id),)):
+                raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [
+                    'Вы уже подписаны на этого пользователя!']})
+            change_counter(User, following.id, 'followers_count', 1)
+            following.is_subscribed = True
+            serializer = SubscriptionSerializer(
+                following, context={'request': request})
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         if request.method == 'DELETE':
-            subscription = Subscription.objects.filter(
-                user=user, following=following
-            )
-            subscription.delete()
+            if not Subscription.objects.filter(
+                    user=user, following_id=following_id).delete()[0]:
+                get_object_or_404(User.objects.only('id'), id=following_id)
+                raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [
+                    'Нельзя отменить несуществующую подписку!']})
+            change_counter(User, following_id, 'followers_count', -1)
             return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
@@ -171,7 +586,10 @@ class UserViewSet(UserViewSet):
     )
     def subscriptions(self, request):
         user = request.user
-        queryset = User.objects.filter(following__user=user)
+        queryset = User.objects.filter(following__user=user).annotate(
+            is_subscribed=Value(True, output_field=BooleanField()),
+            subscription_id=F('following__id'),
+        ).order_by('-subscription_id')
         pages = self.paginate_queryset(queryset)
         serializer = SubscriptionSerializer(pages,
                                             many=True,
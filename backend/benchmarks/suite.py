@@ -0,0 +1,492 @@
+"""
+Набор нагрузочных сценариев для горячих адресов API.
+
+Модуль используется только командами seed_benchmark и benchmark_api и не
+входит в приложения проекта.
+
+BenchmarkSeeder создает пользователей, рецепты, избранное, корзины и
+подписки с распределениями, похожими на реальные: рецепты, авторы и
+ингредиенты выбираются по закону Ципфа (немногие популярные и длинный
+хвост), размеры избранного, корзин и подписок распределены
+экспоненциально. Все записи создаются пакетами, счетчики и агрегат
+корзин пересчитываются в конце.
+
+BenchmarkRunner выполняет сценарии через WSGI-приложение в текущем
+процессе или по HTTP против запущенного gunicorn и возвращает
+пропускную способность, задержки (p50, p95, p99) и число SQL-запросов
+на запрос. В текущем процессе SQL-запросы считаются напрямую, по HTTP -
+берутся из заголовка Server-Timing (нужен METRICS_ENABLED; запросы,
+выполненные при отдаче потокового ответа, в заголовок не попадают).
+"""
+import http.client
+import io
+import json
+import random
+import re
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlencode, urlsplit
+from wsgiref.util import setup_testing_defaults
+
+from api.cache import RECIPES, bump_version
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.wsgi import get_wsgi_application
+from django.db import connection, connections, transaction
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from recipes.counters import reconcile_counters
+from recipes.images import schedule_renditions
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, ShoppingCartIngredient, Tag)
+from recipes.search import update_search_documents
+from rest_framework.authtoken.models import Token
+from users.models import Subscription
+
+User = get_user_model()
+
+BATCH_SIZE = 1000
+AUTHOR_SHARE = 0.2
+ZIPF_EXPONENT = 1.1
+INGREDIENTS_PER_RECIPE = (3, 12)
+TAGS_PER_RECIPE = (1, 3)
+BENCHMARK_PASSWORD = 'benchmark-password'
+
+FEED_PAGES = 3
+SUBSCRIPTION_PAGES = 2
+AUTOCOMPLETE_LETTERS = 4
+SQL_COUNT_PATTERN = re.compile(r'desc="(\d+) SQL"')
+
+
+def get_zipf_weights(count, exponent=ZIPF_EXPONENT):
+    return [1 / rank ** exponent for rank in range(1, count + 1)]
+
+
+def choose_distinct(rng, population, weights, count):
+    """Выбирает до count разных элементов с учетом весов."""
+    count = min(count, len(population))
+    chosen = {}
+    while len(chosen) < count:
+        for item in rng.choices(population, weights, k=count * 2):
+            chosen.setdefault(item, None)
+            if len(chosen) == count:
+                break
+    return list(chosen)
+
+
+def get_size(rng, mean, limit):
+    """Размер из экспоненциального распределения со средним mean."""
+    if mean <= 0:
+        return 0
+    return min(limit, int(rng.expovariate(1 / mean)))
+
+
+class BenchmarkSeeder:
+    """Генерация данных для нагрузочных сценариев."""
+
+    def __init__(self, prefix='bench', seed=0):
+        self.prefix = prefix
+        self.rng = random.Random(seed)
+
+    def run(self, users, recipes, favorites, cart_share, cart,
+            subscriptions):
+        """Создает данные и возвращает число созданных записей по типам."""
+        tags = list(Tag.objects.values_list('id', flat=True))
+        ingredients = list(Ingredient.objects.values_list('id', flat=True))
+        if not tags or not ingredients:
+            raise ValueError(
+                'Для генерации рецептов нужны теги и ингредиенты.')
+        self.rng.shuffle(ingredients)
+        with transaction.atomic():
+            user_ids = self.create_users(users)
+            authors = self.rng.sample(
+                user_ids, max(1, int(len(user_ids) * AUTHOR_SHARE)))
+            recipe_ids = self.create_recipes(
+                recipes, authors, tags, ingredients)
+            popular = self.rng.sample(recipe_ids, len(recipe_ids))
+            counts = {
+                'users': len(user_ids),
+                'recipes': len(recipe_ids),
+                'favorites': self.create_relations(
+                    Favorite, 'recipe', user_ids, popular, favorites),
+                'shopping_cart': self.create_relations(
+                    ShoppingCart, 'recipe',
+                    self.rng.sample(
+                        user_ids, int(len(user_ids) * cart_share)),
+                    popular, cart, minimum=1),
+                'subscriptions': self.create_relations(
+                    Subscription, 'following', user_ids, authors,
+                    subscriptions),
+            }
+            reconcile_counters()
+            ShoppingCartIngredient.objects.rebuild(user_ids)
+            transaction.on_commit(lambda: update_search_documents(recipe_ids))
+            bump_version(RECIPES)
+        return counts
+
+    def create_users(self, count):
+        if User.objects.filter(username__startswith=self.prefix).exists():
+            raise ValueError(
+                f'Пользователи с префиксом {self.prefix} уже существуют.')
+        password = make_password(BENCHMARK_PASSWORD)
+        User.objects.bulk_create(
+            (
+                User(
+                    username=f'{self.prefix}{number}',
+                    email=f'{self.prefix}{number}@example.com',
+                    first_name='Нагрузочный',
+                    last_name=f'Пользователь {number}',
+                    password=password,
+                )
+                for number in range(count)
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        return list(User.objects.filter(
+            username__startswith=self.prefix
+        ).order_by('id').values_list('id', flat=True))
+
+    def create_recipes(self, count, authors, tags, ingredients):
+        image_field = Recipe._meta.get_field('image')
+        image = image_field.storage.save(
+            image_field.generate_filename(None, f'{self.prefix}.png'),
+            ContentFile(self.get_image()))
+        author_weights = get_zipf_weights(len(authors))
+        name_prefix = f'{self.prefix} '
+        Recipe.objects.bulk_create(
+            (
+                Recipe(
+                    author_id=author_id,
+                    name=f'{name_prefix}рецепт {number}',
+                    text=f'Описание рецепта {number} для нагрузочных тестов.',
+                    cooking_time=max(1, min(
+                        300, int(self.rng.lognormvariate(3.3, 0.6)))),
+                    image=image,
+                )
+                for number, author_id in enumerate(self.rng.choices(
+                    authors, author_weights, k=count))
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        recipe_ids = list(Recipe.objects.filter(
+            name__startswith=name_prefix, author_id__in=authors
+        ).order_by('id').values_list('id', flat=True))
+        ingredient_weights = get_zipf_weights(len(ingredients))
+        RecipeIngredient.objects.bulk_create(
+            (
+                RecipeIngredient(
+                    recipe_id=recipe_id,
+                    ingredients_id=ingredient_id,
+                    amount=self.rng.randint(1, 500),
+                )
+                for recipe_id in recipe_ids
+                for ingredient_id in choose_distinct(
+                    self.rng, ingredients, ingredient_weights,
+                    self.rng.randint(*INGREDIENTS_PER_RECIPE))
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        Recipe.tags.through.objects.bulk_create(
+            (
+                Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+                for recipe_id in recipe_ids
+                for tag_id in self.rng.sample(tags, min(
+                    len(tags), self.rng.randint(*TAGS_PER_RECIPE)))
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        schedule_renditions(image)
+        return recipe_ids
+
+    def create_relations(self, model, field_name, user_ids, targets, mean,
+                         minimum=0):
+        """Связывает пользователей с популярными по Ципфу записями."""
+        weights = get_zipf_weights(len(targets))
+        relations = []
+        for user_id in user_ids:
+            size = max(minimum, get_size(self.rng, mean, len(targets)))
+            relations.extend(
+                model(user_id=user_id, **{f'{field_name}_id': target_id})
+                for target_id in choose_distinct(
+                    self.rng, targets, weights, size)
+                if model is not Subscription or target_id != user_id
+            )
+        model.objects.bulk_create(
+            relations, batch_size=BATCH_SIZE, ignore_conflicts=True)
+        return len(relations)
+
+    @staticmethod
+    def get_image():
+        buffer = io.BytesIO()
+        Image.new('RGB', (64, 64), (200, 120, 60)).save(buffer, 'PNG')
+        return buffer.getvalue()
+
+
+class WSGITransport:
+    """Запросы к WSGI-приложению в текущем процессе."""
+
+    name = 'wsgi'
+
+    def __init__(self):
+        self.application = get_wsgi_application()
+
+    def request(self, method, path, headers):
+        url = urlsplit(path)
+        environ = {
+            'REQUEST_METHOD': method,
+            'PATH_INFO': url.path,
+            'QUERY_STRING': url.query,
+            'wsgi.input': io.BytesIO(),
+        }
+        for header, value in headers.items():
+            environ[f'HTTP_{header.upper().replace("-", "_")}'] = value
+        setup_testing_defaults(environ)
+        response_start = {}
+
+        def start_response(status, response_headers, exc_info=None):
+            response_start['status'] = int(status.split()[0])
+            response_start['headers'] = {
+                header.lower(): value for header, value in response_headers}
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.application(environ, start_response)
+            try:
+                body = b''.join(response)
+            finally:
+                response.close()
+        return (
+            response_start['status'],
+            response_start['headers'],
+            body,
+            len(queries),
+        )
+
+    def close(self):
+        connections.close_all()
+
+
+class HTTPTransport:
+    """Запросы к запущенному серверу, одно соединение на поток."""
+
+    def __init__(self, url):
+        self.name = url
+        url = urlsplit(url)
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.local = threading.local()
+
+    def request(self, method, path, headers):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = http.client.HTTPConnection(
+                self.host, self.port, timeout=30)
+            self.local.connection = connection
+        connection.request(method, path, headers=headers)
+        response = connection.getresponse()
+        body = response.read()
+        queries = SQL_COUNT_PATTERN.search(
+            response.getheader('Server-Timing', ''))
+        return (
+            response.status,
+            {header.lower(): value for header, value in response.getheaders()},
+            body,
+            int(queries.group(1)) if queries else None,
+        )
+
+    def close(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self.local.connection = None
+
+
+class Session:
+    """Запросы одного пользователя с записью замеров."""
+
+    def __init__(self, transport, token, samples):
+        self.transport = transport
+        self.headers = {'Authorization': f'Token {token}'}
+        self.samples = samples
+
+    def request(self, method, path):
+        started_at = time.perf_counter()
+        status, _, body, queries = self.transport.request(
+            method, path, self.headers)
+        self.samples.append(
+            ((time.perf_counter() - started_at) * 1000, status, queries))
+        return status, body
+
+    def get_json(self, path):
+        status, body = self.request('GET', path)
+        if status != 200:
+            return None
+        return json.loads(body)
+
+
+def get_path(url):
+    url = urlsplit(url)
+    return f'{url.path}?{url.query}' if url.query else url.path
+
+
+def browse_feed(session, context, rng):
+    """Лента рецептов с фильтром по тегам, несколько страниц."""
+    tags = rng.sample(context['tags'], min(2, len(context['tags'])))
+    path = '/api/recipes/?' + urlencode(
+        [('limit', 6)] + [('tags', slug) for slug in tags])
+    for _ in range(FEED_PAGES):
+        page = session.get_json(path)
+        if not page or not page.get('next'):
+            break
+        path = get_path(page['next'])
+
+
+def autocomplete_ingredients(session, context, rng):
+    """Поиск ингредиента по мере ввода названия."""
+    name = rng.choice(context['ingredients'])
+    for length in range(1, min(AUTOCOMPLETE_LETTERS, len(name)) + 1):
+        session.request(
+            'GET', f'/api/ingredients/?name={quote(name[:length])}')
+
+
+def browse_subscriptions(session, context, rng):
+    """Подписка на автора, просмотр подписок и отписка."""
+    author_id = rng.choice(context['authors'])
+    status, _ = session.request('POST', f'/api/users/{author_id}/subscribe/')
+    path = '/api/users/subscriptions/?limit=6&recipes_limit=3'
+    for _ in range(SUBSCRIPTION_PAGES):
+        page = session.get_json(path)
+        if not page or not page.get('next'):
+            break
+        path = get_path(page['next'])
+    if status == 201:
+        session.request('DELETE', f'/api/users/{author_id}/subscribe/')
+
+
+def download_shopping_cart(session, context, rng):
+    """Выгрузка списка покупок."""
+    session.request('GET', '/api/recipes/download_shopping_cart/')
+
+
+SCENARIOS = {
+    'feed': (browse_feed, 'users'),
+    'autocomplete': (autocomplete_ingredients, 'users'),
+    'subscriptions': (browse_subscriptions, 'users'),
+    'cart_download': (download_shopping_cart, 'cart_users'),
+}
+
+
+def get_percentile(percentiles, value):
+    return round(percentiles[value - 1], 2)
+
+
+class BenchmarkRunner:
+    """Выполнение сценариев и сводка замеров."""
+
+    def __init__(self, transport, prefix='bench', seed=0, concurrency=1):
+        self.transport = transport
+        self.seed = seed
+        self.concurrency = concurrency
+        self.context = self.get_context(prefix)
+
+    def get_context(self, prefix):
+        users = User.objects.filter(username__startswith=prefix)
+        user_ids = list(users.values_list('id', flat=True))
+        if not user_ids:
+            raise ValueError(
+                f'Нет пользователей с префиксом {prefix}: '
+                'сначала запустите seed_benchmark.')
+        tokens = dict(Token.objects.filter(
+            user_id__in=user_ids).values_list('user_id', 'key'))
+        missing = [
+            Token(user_id=user_id, key=Token.generate_key())
+            for user_id in user_ids if user_id not in tokens
+        ]
+        Token.objects.bulk_create(missing, batch_size=BATCH_SIZE)
+        tokens.update((token.user_id, token.key) for token in missing)
+        cart_users = set(ShoppingCart.objects.filter(
+            user_id__in=user_ids).values_list('user_id', flat=True))
+        return {
+            'users': list(tokens.values()),
+            'cart_users': [
+                key for user_id, key in tokens.items()
+                if user_id in cart_users
+            ],
+            'authors': list(users.filter(recipes_count__gt=0).values_list(
+                'id', flat=True)),
+            'tags': list(Tag.objects.values_list('slug', flat=True)),
+            'ingredients': list(Ingredient.objects.values_list(
+                'name', flat=True)[:1000]),
+        }
+
+    def run(self, scenarios, iterations):
+        return {
+            'transport': self.transport.name,
+            'database': connections['default'].vendor,
+            'concurrency': self.concurrency,
+            'iterations': iterations,
+            'seed': self.seed,
+            'scenarios': {
+                name: self.run_scenario(name, iterations)
+                for name in scenarios
+            },
+        }
+
+    def run_scenario(self, name, iterations):
+        scenario, users = SCENARIOS[name]
+        tokens = self.context[users]
+        if not tokens:
+            return None
+        self.run_iterations(scenario, tokens, 1, self.seed - 1)
+        started_at = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            results = executor.map(
+                lambda worker: self.run_iterations(
+                    scenario, tokens,
+                    len(range(worker, iterations, self.concurrency)),
+                    self.seed + worker),
+                range(self.concurrency))
+            samples = [sample for result in results for sample in result]
+        duration = time.perf_counter() - started_at
+        return self.summarize(samples, duration)
+
+    def run_iterations(self, scenario, tokens, iterations, seed):
+        rng = random.Random(seed)
+        samples = []
+        try:
+            for _ in range(iterations):
+                session = Session(
+                    self.transport, rng.choice(tokens), samples)
+                scenario(session, self.context, rng)
+        finally:
+            self.transport.close()
+        return samples
+
+    @staticmethod
+    def summarize(samples, duration):
+        timings = [elapsed for elapsed, _, _ in samples]
+        queries = [count for _, _, count in samples if count is not None]
+        statuses = {}
+        for _, status, _ in samples:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        summary = {
+            'requests': len(samples),
+            'errors': sum(status >= 500 for _, status, _ in samples),
+            'statuses': statuses,
+            'duration_s': round(duration, 3),
+            'throughput_rps': round(len(samples) / duration, 2),
+            'latency_ms': None,
+            'queries_per_request': (
+                round(statistics.mean(queries), 2) if queries else None),
+        }
+        if len(timings) > 1:
+            percentiles = statistics.quantiles(timings, n=100)
+            summary['latency_ms'] = {
+                'mean': round(statistics.mean(timings), 2),
+                'p50': get_percentile(percentiles, 50),
+                'p95': get_percentile(percentiles, 95),
+                'p99': get_percentile(percentiles, 99),
+            }
+        return summary
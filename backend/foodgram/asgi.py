@@ -9,8 +9,63 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+from asgiref.sync import sync_to_async
+from django.core.handlers import asgi
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
 
-application = get_asgi_application()
+
+class ASGIHandler(asgi.ASGIHandler):
+    """
+    Обработчик ASGI, читающий потоковые ответы вне цикла событий.
+
+    Django 3.2 перебирает потоковый ответ прямо в цикле событий, поэтому
+    запросы к базе данных внутри генератора (выгрузка списка покупок)
+    завершаются ошибкой SynchronousOnlyOperation. Здесь части ответа
+    читаются в общем синхронном потоке порциями по chunk_size байт.
+    """
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+        response_headers = [
+            (header.encode('ascii'), value.encode('latin1'))
+            for header, value in response.items()
+        ]
+        for cookie in response.cookies.values():
+            response_headers.append((
+                b'Set-Cookie',
+                cookie.output(header='').encode('ascii').strip(),
+            ))
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': response_headers,
+        })
+        read_parts = sync_to_async(self.read_parts, thread_sensitive=True)
+        parts = iter(response)
+        while True:
+            body = await read_parts(parts)
+            if not body:
+                break
+            for chunk, _ in self.chunk_bytes(body):
+                await send({
+                    'type': 'http.response.body',
+                    'body': chunk,
+                    'more_body': True,
+                })
+        await send({'type': 'http.response.body'})
+        await sync_to_async(response.close, thread_sensitive=True)()
+
+    def read_parts(self, parts):
+        body = bytearray()
+        for part in parts:
+            body += part
+            if len(body) >= self.chunk_size:
+                break
+        return bytes(body)
+
+
+django.setup(set_prefix=False)
+application = ASGIHandler()
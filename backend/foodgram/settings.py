@@ -34,6 +34,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -68,6 +69,7 @@ if DEBUG:
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': os.path.join(BASE_DIR, 'db_sqlite3'),
+            'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
         }
     }
 else:
@@ -78,10 +80,29 @@ else:
             'USER': os.getenv('POSTGRES_USER'),
             'PASSWORD': os.getenv('POSTGRES_PASSWORD'),
             'HOST': os.getenv('DB_HOST'),
-            'PORT': os.getenv('DB_PORT')
+            'PORT': os.getenv('DB_PORT'),
+            'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': (
+                os.getenv('DB_CONN_HEALTH_CHECKS', '').lower() == 'true'),
+            'DISABLE_SERVER_SIDE_CURSORS': (
+                os.getenv('DB_DISABLE_SERVER_SIDE_CURSORS', '').lower()
+                == 'true'),
+            'OPTIONS': {
+                'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', 5)),
+            },
         }
     }
 
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', (
+            'django.core.cache.backends.locmem.LocMemCache' if DEBUG
+            else 'django.core.cache.backends.memcached.PyMemcacheCache')),
+        'LOCATION': os.getenv(
+            'CACHE_LOCATION', '' if DEBUG else 'memcached:11211'),
+    }
+}
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -118,10 +139,22 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ),
 }
 
+TOKEN_CACHE_ALIAS = os.getenv('TOKEN_CACHE_ALIAS', 'default')
+TOKEN_CACHE_TIMEOUT = int(os.getenv('TOKEN_CACHE_TIMEOUT', 5 * 60))
+TOKEN_LOCAL_CACHE_SIZE = int(os.getenv('TOKEN_LOCAL_CACHE_SIZE', 1024))
+TOKEN_LOCAL_CACHE_TIMEOUT = int(os.getenv('TOKEN_LOCAL_CACHE_TIMEOUT', 10))
+
+ASYNC_READ_VIEWS = os.getenv('ASYNC_READ_VIEWS', '').lower() == 'true'
+ASYNC_READ_THREADS = int(os.getenv('ASYNC_READ_THREADS', 8))
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '').lower() == 'true'
+METRICS_ALLOWED_IPS = os.getenv('METRICS_ALLOWED_IPS', '127.0.0.1').split(',')
+QUERY_BUDGET = int(os.getenv('QUERY_BUDGET', 0))
+
 DJOSER = {
     'HIDE_USERS': False,
     'SERIALIZERS': {
@@ -140,6 +173,8 @@ AUTH_USER_MODEL = 'users.User'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+IMAGE_RENDITION_WORKERS = int(os.getenv('IMAGE_RENDITION_WORKERS', 2))
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
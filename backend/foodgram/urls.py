@@ -1,3 +1,4 @@
+from api.metrics import metrics_view
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
@@ -8,6 +9,9 @@ urlpatterns = [
     path('api/', include('api.urls')),
 ]
 
+if settings.METRICS_ENABLED:
+    urlpatterns.append(path('metrics', metrics_view))
+
 if settings.DEBUG:
     urlpatterns += static(
         settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -0,0 +1,30 @@
+"""
+Настройки gunicorn.
+
+Значения берутся из переменных окружения. Для ASGI-приложения
+(GUNICORN_APP=foodgram.asgi) используются воркеры uvicorn, для WSGI -
+синхронные процессы или gthread при GUNICORN_THREADS > 1. Каждый поток
+держит свое постоянное соединение с базой данных (DB_CONN_MAX_AGE),
+поэтому число потоков всех воркеров (для ASGI - ASYNC_READ_THREADS + 1 на
+воркер) не должно превышать max_connections PostgreSQL (или размер пула
+PgBouncer).
+"""
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0:9000')
+wsgi_app = os.getenv('GUNICORN_APP', 'foodgram.wsgi')
+workers = int(os.getenv(
+    'GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('GUNICORN_THREADS', 1))
+if wsgi_app.endswith('.asgi'):
+    default_worker_class = 'uvicorn.workers.UvicornWorker'
+elif threads > 1:
+    default_worker_class = 'gthread'
+else:
+    default_worker_class = 'sync'
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', default_worker_class)
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 100))
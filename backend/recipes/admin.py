@@ -38,8 +38,9 @@ class RecipeAdmin(admin.ModelAdmin):
     get_ingredients.short_description = 'Ингредиенты'
 
     def get_favorites(self, obj):
-        return obj.favorites.count()
+        return obj.favorites_count
     get_favorites.short_description = 'Избранное'
+    get_favorites.admin_order_field = 'favorites_count'
 
 
 @admin.register(Ingredient)
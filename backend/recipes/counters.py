@@ -0,0 +1,67 @@
+"""
+Денормализованные счетчики рецептов и пользователей.
+
+Счетчики изменяются атомарными UPDATE с F() там, где создаются и
+удаляются соответствующие записи; пакетные операции пересчитывают
+счетчики затронутых записей подзапросом (recount). Расхождения (например, после
+каскадного удаления пользователя) исправляются командой
+reconcile_counters, которая пересчитывает значения подзапросами.
+"""
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from users.models import Subscription, User
+
+from .models import Favorite, Recipe, ShoppingCart
+
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'cart_count', ShoppingCart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Subscription, 'following'),
+)
+
+
+def change_counter(model, pk, counter, delta):
+    """Атомарно изменяет счетчик записи на delta."""
+    model.objects.filter(pk=pk).update(**{counter: F(counter) + delta})
+
+
+def recount(model, pks, counter):
+    """Пересчитывает счетчик записей по данным одним UPDATE."""
+    source, field_name = next(
+        (source, field_name)
+        for counter_model, counter_name, source, field_name in COUNTERS
+        if counter_model is model and counter_name == counter
+    )
+    model.objects.filter(pk__in=pks).update(
+        **{counter: get_actual_count(source, field_name)})
+
+
+def get_actual_count(source, field_name):
+    return Coalesce(Subquery(
+        source.objects.filter(
+            **{field_name: OuterRef('pk')}
+        ).order_by().values(field_name).annotate(
+            count=Count('pk')).values('count')
+    ), 0)
+
+
+def get_drift(model, counter, source, field_name):
+    """Возвращает записи, у которых счетчик не совпадает с данными."""
+    return model.objects.annotate(
+        actual=get_actual_count(source, field_name)
+    ).exclude(**{counter: F('actual')}).order_by()
+
+
+def reconcile_counters():
+    """
+    Исправляет расхождения счетчиков.
+
+    Возвращает словарь {'модель.счетчик': число исправленных записей}.
+    """
+    fixed = {}
+    for model, counter, source, field_name in COUNTERS:
+        fixed[f'{model._meta.model_name}.{counter}'] = get_drift(
+            model, counter, source, field_name
+        ).update(**{counter: get_actual_count(source, field_name)})
+    return fixed
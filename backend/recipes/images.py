@@ -0,0 +1,141 @@
+"""
+Хранение картинок рецептов и подготовка их уменьшенных копий.
+
+Файлы картинок называются по SHA-256 содержимого, поэтому одинаковые
+загрузки хранятся один раз. Уменьшенные копии (рендишены) строятся пулом
+фоновых потоков после фиксации транзакции и сохраняются рядом с оригиналом
+под предсказуемыми именами. После построения копий отправляется сигнал
+renditions_built, чтобы закэшированные ответы со ссылками на оригинал
+обновились.
+"""
+import hashlib
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from threading import Lock
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import close_old_connections, transaction
+from django.dispatch import Signal
+from django.utils.deconstruct import deconstructible
+from PIL import Image
+
+MAX_IMAGE_SIZE = 5 * 1024 * 1024
+MAX_IMAGE_PIXELS = 25_000_000
+RENDITIONS_DIR = 'renditions'
+RENDITION_SIZES = {
+    'thumbnail': (160, 160),
+    'card': (640, 480),
+}
+RENDITION_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+
+logger = logging.getLogger(__name__)
+executor = ThreadPoolExecutor(
+    max_workers=settings.IMAGE_RENDITION_WORKERS,
+    thread_name_prefix='image-renditions',
+)
+pending = set()
+pending_lock = Lock()
+renditions_built = Signal()
+
+
+def get_content_hash_name(name, content):
+    """Возвращает имя файла по SHA-256 содержимого в том же каталоге."""
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    dirname, filename = os.path.split(name)
+    extension = os.path.splitext(filename)[1].lower()
+    return os.path.join(dirname, f'{digest.hexdigest()}{extension}')
+
+
+@deconstructible
+class ContentHashStorage(FileSystemStorage):
+    """Файловое хранилище, называющее файлы по хешу содержимого."""
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        name = get_content_hash_name(name, content)
+        if self.exists(name):
+            return name
+        return super()._save(name, content)
+
+
+def get_rendition_name(image_name, size, image_format):
+    dirname, filename = os.path.split(image_name)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(
+        dirname, RENDITIONS_DIR, f'{stem}_{size}.{image_format}')
+
+
+def get_rendition_names(image_name):
+    """Возвращает имена рендишенов: {размер: {формат: имя файла}}."""
+    return {
+        size: {
+            image_format: get_rendition_name(image_name, size, image_format)
+            for image_format in RENDITION_FORMATS
+        }
+        for size in RENDITION_SIZES
+    }
+
+
+def build_renditions(image_name, storage=default_storage):
+    """Строит недостающие рендишены картинки."""
+    names = get_rendition_names(image_name)
+    missing = [
+        (size, image_format, name)
+        for size, formats in names.items()
+        for image_format, name in formats.items()
+        if not storage.exists(name)
+    ]
+    if not missing:
+        return
+    with storage.open(image_name) as file, Image.open(file) as original:
+        original.load()
+        if original.mode not in ('RGB', 'RGBA'):
+            original = original.convert('RGBA')
+        for size, image_format, name in missing:
+            rendition = original.copy()
+            rendition.thumbnail(RENDITION_SIZES[size], Image.LANCZOS)
+            pil_format, options = RENDITION_FORMATS[image_format]
+            if pil_format == 'JPEG' and rendition.mode != 'RGB':
+                rendition = rendition.convert('RGB')
+            buffer = BytesIO()
+            rendition.save(buffer, pil_format, **options)
+            storage.save(name, ContentFile(buffer.getvalue()))
+    renditions_built.send(sender=storage.__class__, image_name=image_name)
+
+
+def _build_renditions_safely(image_name):
+    try:
+        build_renditions(image_name)
+    except Exception:
+        logger.exception('Не удалось построить рендишены %s', image_name)
+    finally:
+        close_old_connections()
+        with pending_lock:
+            pending.discard(image_name)
+
+
+def _submit(image_name):
+    with pending_lock:
+        if image_name in pending:
+            return
+        pending.add(image_name)
+    executor.submit(_build_renditions_safely, image_name)
+
+
+def schedule_renditions(image_name):
+    """Ставит построение рендишенов в очередь после фиксации транзакции."""
+    if not image_name:
+        return
+    transaction.on_commit(lambda: _submit(image_name))
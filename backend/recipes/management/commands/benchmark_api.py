@@ -0,0 +1,79 @@
+import json
+
+from benchmarks.suite import (SCENARIOS, BenchmarkRunner, HTTPTransport,
+                              WSGITransport)
+from django.core.management import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочные сценарии для горячих адресов API: пропускная '
+        'способность, задержки p50/p95/p99 и SQL-запросы на запрос в JSON. '
+        'Данные готовит команда seed_benchmark'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'scenarios',
+            nargs='*',
+            help=f'Сценарии ({", ".join(SCENARIOS)}); по умолчанию все',
+        )
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=50,
+            help='Количество прогонов каждого сценария',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=1,
+            help='Количество параллельных клиентов',
+        )
+        parser.add_argument(
+            '--url',
+            help='Адрес запущенного сервера, например http://127.0.0.1:9000; '
+                 'по умолчанию запросы идут в WSGI-приложение процесса',
+        )
+        parser.add_argument(
+            '--prefix',
+            default='bench',
+            help='Префикс пользователей, созданных seed_benchmark',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Начальное значение генератора случайных чисел',
+        )
+        parser.add_argument(
+            '--output',
+            help='Файл для отчета; по умолчанию отчет выводится в stdout',
+        )
+
+    def handle(self, *args, scenarios, iterations=50, concurrency=1,
+               url=None, prefix='bench', seed=0, output=None, **kwargs):
+        if iterations < 2 or concurrency < 1:
+            raise CommandError(
+                'Нужно не меньше двух прогонов и одного клиента.')
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(
+                f'Неизвестные сценарии: {", ".join(sorted(unknown))}')
+        transport = HTTPTransport(url) if url else WSGITransport()
+        try:
+            runner = BenchmarkRunner(
+                transport, prefix=prefix, seed=seed, concurrency=concurrency)
+        except ValueError as error:
+            raise CommandError(error)
+        report = json.dumps(
+            runner.run(scenarios or list(SCENARIOS), iterations),
+            ensure_ascii=False,
+            indent=2,
+        )
+        if output is None:
+            self.stdout.write(report)
+            return
+        with open(output, 'w', encoding='utf-8') as file:
+            file.write(report + '\n')
+        self.stdout.write(self.style.SUCCESS(f'Отчет сохранен в {output}'))
@@ -0,0 +1,86 @@
+import statistics
+import time
+from urllib.parse import urlsplit
+from wsgiref.util import setup_testing_defaults
+
+from django.core.management import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.db import connections
+
+DEFAULT_PATHS = ('/api/recipes/', '/api/users/', '/api/tags/')
+WARMUP_REQUESTS = 5
+
+
+class Command(BaseCommand):
+    help = (
+        'Замер задержки (p50, p99) запросов к API при разных CONN_MAX_AGE. '
+        'Запросы идут через WSGI-приложение в текущем процессе, с теми же '
+        'сигналами начала и конца запроса, что и под gunicorn'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths',
+            nargs='*',
+            default=DEFAULT_PATHS,
+            help='Адреса запросов',
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=200,
+            help='Количество запросов на адрес',
+        )
+        parser.add_argument(
+            '--conn-max-age',
+            type=int,
+            action='append',
+            dest='conn_max_ages',
+            help='Значение CONN_MAX_AGE; можно указать несколько раз',
+        )
+        parser.add_argument(
+            '--token',
+            help='Токен авторизации для запросов',
+        )
+
+    def handle(self, *args, paths, requests=200, conn_max_ages=None,
+               token=None, **kwargs):
+        if requests < 2:
+            raise CommandError('Нужно не меньше двух запросов на адрес.')
+        application = get_wsgi_application()
+        for conn_max_age in conn_max_ages or (0, 60):
+            for connection in connections.all():
+                connection.close()
+                connection.settings_dict['CONN_MAX_AGE'] = conn_max_age
+            for path in paths:
+                for _ in range(WARMUP_REQUESTS):
+                    self.request(application, path, token)
+                timings = [
+                    self.request(application, path, token)
+                    for _ in range(requests)
+                ]
+                percentiles = statistics.quantiles(timings, n=100)
+                self.stdout.write(
+                    f'CONN_MAX_AGE={conn_max_age} {path}: '
+                    f'p50 {percentiles[49]:.2f} мс, '
+                    f'p99 {percentiles[98]:.2f} мс'
+                )
+
+    def request(self, application, path, token):
+        url = urlsplit(path)
+        environ = {
+            'REQUEST_METHOD': 'GET',
+            'PATH_INFO': url.path,
+            'QUERY_STRING': url.query,
+        }
+        if token:
+            environ['HTTP_AUTHORIZATION'] = f'Token {token}'
+        setup_testing_defaults(environ)
+        start = time.perf_counter()
+        response = application(environ, lambda status, headers: None)
+        try:
+            for _ in response:
+                pass
+        finally:
+            response.close()
+        return (time.perf_counter() - start) * 1000
@@ -0,0 +1,21 @@
+from django.core.management import BaseCommand
+from recipes.images import build_renditions
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Построение уменьшенных копий картинок рецептов'
+
+    def handle(self, *args, **kwargs):
+        image_names = Recipe.objects.exclude(image='').values_list(
+            'image', flat=True).distinct().order_by()
+        count = 0
+        for image_name in image_names.iterator():
+            try:
+                build_renditions(image_name)
+            except OSError as error:
+                self.stderr.write(f'{image_name}: {error}')
+                continue
+            count += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Уменьшенные копии построены для картинок: {count}'))
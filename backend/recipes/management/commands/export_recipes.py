@@ -0,0 +1,46 @@
+import sys
+
+from api.recipe_transfer import (CHUNK_SIZE, export_ndjson, export_zip,
+                                 get_export_queryset)
+from django.core.management import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Потоковая выгрузка рецептов в NDJSON или zip-архив'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            help='Путь к файлу выгрузки; - для вывода в stdout',
+        )
+        parser.add_argument(
+            '--format',
+            dest='export_format',
+            choices=('ndjson', 'zip'),
+            help='Формат выгрузки; по умолчанию определяется по расширению',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=CHUNK_SIZE,
+            help='Количество рецептов, загружаемых одним запросом',
+        )
+
+    def handle(self, *args, path, export_format=None, chunk_size=CHUNK_SIZE,
+               **kwargs):
+        if export_format is None:
+            export_format = 'zip' if path.endswith('.zip') else 'ndjson'
+        queryset = get_export_queryset()
+        if export_format == 'zip':
+            chunks = export_zip(queryset, chunk_size)
+        else:
+            chunks = (
+                line.encode() for line in export_ndjson(queryset, chunk_size))
+        if path == '-':
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            return
+        with open(path, 'wb') as file:
+            for chunk in chunks:
+                file.write(chunk)
+        self.stdout.write(self.style.SUCCESS(f'Рецепты выгружены в {path}'))
@@ -1,22 +1,131 @@
 import csv
+import json
+import os
+import re
+import sys
 
+from api.ingredient_index import IngredientIndex
+from api.relations import insert_ignore
 from django.conf import settings
-from django.core.management import BaseCommand
+from django.core.management import BaseCommand, CommandError
 from recipes.models import Ingredient
 
+BATCH_SIZE = 1000
+READ_SIZE = 64 * 1024
+SEPARATORS = re.compile(r'[\s,]*')
+
+
+def read_csv(file):
+    yield from csv.DictReader(file)
+
+
+def read_json(file):
+    """
+    Читает JSON-массив объектов по одному объекту.
+
+    Файл разбирается блоками через JSONDecoder.raw_decode, поэтому в
+    памяти держится только текущий блок, а не весь каталог.
+    """
+    decoder = json.JSONDecoder()
+    buffer = file.read(READ_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise CommandError('Ожидается JSON-массив ингредиентов')
+    position = 1
+    while True:
+        position = SEPARATORS.match(buffer, position).end()
+        if position < len(buffer) and buffer[position] == ']':
+            return
+        try:
+            item, position = decoder.raw_decode(buffer, position)
+        except ValueError:
+            chunk = file.read(READ_SIZE)
+            if not chunk:
+                raise CommandError('Некорректный JSON-файл')
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        yield item
+
+
+READERS = {
+    'csv': read_csv,
+    'json': read_json,
+}
+
 
 class Command(BaseCommand):
-    help = 'Загрузка ингредиентов'
-
-    def handle(self, *args, **kwargs):
-        data_path = settings.BASE_DIR
-        with open(
-            f'{data_path}/data/ingredients.csv',
-            'r',
-            encoding='utf-8'
-        ) as file:
-            reader = csv.DictReader(file)
-            Ingredient.objects.bulk_create(
-                Ingredient(**ingredient_data) for ingredient_data in reader
+    help = (
+        'Загрузка ингредиентов. Ключом служит пара (название, единица '
+        'измерения), других полей у ингредиента нет, поэтому существующие '
+        'ингредиенты не изменяются, а повторы пропускаются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            nargs='?',
+            default=os.path.join(settings.BASE_DIR, 'data', 'ingredients.csv'),
+            help='Путь к файлу CSV или JSON; - для чтения из stdin',
+        )
+        parser.add_argument(
+            '--format',
+            dest='input_format',
+            choices=READERS,
+            help='Формат файла; по умолчанию определяется по расширению',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help='Количество ингредиентов, записываемых одним запросом',
+        )
+
+    def handle(self, *args, path, input_format=None, batch_size=BATCH_SIZE,
+               **kwargs):
+        if input_format is None:
+            input_format = 'json' if path.endswith('.json') else 'csv'
+        reader = READERS[input_format]
+        self.inserted = self.skipped = 0
+        if path == '-':
+            self.load(reader(sys.stdin), batch_size)
+        else:
+            with open(path, 'r', encoding='utf-8') as file:
+                self.load(reader(file), batch_size)
+        IngredientIndex.invalidate()
+        self.stdout.write(self.style.SUCCESS(
+            f'Ингредиенты импортированы! Добавлено: {self.inserted}, '
+            f'пропущено: {self.skipped}'))
+
+    def load(self, rows, batch_size):
+        batch = {}
+        for row in rows:
+            if not isinstance(row, dict):
+                self.skipped += 1
+                continue
+            key = (
+                str(row.get('name') or '').strip(),
+                str(row.get('measurement_unit') or '').strip(),
             )
-        self.stdout.write(self.style.SUCCESS('Ингредиенты импортированы!'))
+            if not all(key) or key in batch:
+                self.skipped += 1
+                continue
+            batch[key] = row
+            if len(batch) == batch_size:
+                self.upsert(batch)
+                batch = {}
+        if batch:
+            self.upsert(batch)
+
+    def upsert(self, batch):
+        """
+        Добавляет ингредиенты порции, которых еще нет в базе.
+
+        Строки вставляются одним INSERT с пропуском конфликтов по
+        уникальному ограничению; добавленными считаются действительно
+        вставленные строки, остальные (в том числе вставленные
+        параллельным импортом) считаются пропущенными.
+        """
+        inserted = insert_ignore(
+            Ingredient, ('name', 'measurement_unit'), list(batch))
+        self.inserted += inserted
+        self.skipped += len(batch) - inserted
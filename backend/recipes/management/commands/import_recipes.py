@@ -0,0 +1,48 @@
+import sys
+
+from api.recipe_transfer import (CHUNK_SIZE, RecipeImporter, read_ndjson,
+                                 read_records)
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand, CommandError
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Пакетный импорт рецептов из NDJSON или zip-архива'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            help='Путь к файлу NDJSON или zip-архиву; - для NDJSON из stdin',
+        )
+        parser.add_argument(
+            '--author',
+            help='Email автора для записей без поля author',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=CHUNK_SIZE,
+            help='Количество рецептов в одной транзакции',
+        )
+
+    def handle(self, *args, path, author=None, chunk_size=CHUNK_SIZE,
+               **kwargs):
+        if author is not None:
+            try:
+                author = User.objects.get(email=author)
+            except User.DoesNotExist:
+                raise CommandError(f'Пользователь {author} не найден')
+        importer = RecipeImporter(author=author, chunk_size=chunk_size)
+        if path == '-':
+            created, errors = importer.run(read_ndjson(sys.stdin))
+        else:
+            with open(path, 'rb') as file:
+                created, errors = importer.run(read_records(file))
+        for error in errors:
+            self.stderr.write(f'Строка {error["line"]}: {error["errors"]}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Импортировано рецептов: {created}'))
+        if errors:
+            raise CommandError(f'Пропущено записей с ошибками: {len(errors)}')
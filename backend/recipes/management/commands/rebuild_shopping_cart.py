@@ -0,0 +1,52 @@
+from django.core.management import BaseCommand, CommandError
+from recipes.models import ShoppingCartIngredient
+
+
+class Command(BaseCommand):
+    help = 'Пересчет суммарных количеств ингредиентов в корзинах покупок'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только сверить сохраненный агрегат с корзинами покупок',
+        )
+        parser.add_argument(
+            '--user',
+            type=int,
+            action='append',
+            dest='user_ids',
+            help='Ограничить пересчет пользователем с указанным id',
+        )
+
+    def handle(self, *args, check=False, user_ids=None, **kwargs):
+        if not check:
+            count = ShoppingCartIngredient.objects.rebuild(user_ids)
+            self.stdout.write(self.style.SUCCESS(
+                f'Корзины покупок пересчитаны, записей: {count}'))
+            return
+        expected = ShoppingCartIngredient.objects.calculate(user_ids)
+        stored_rows = ShoppingCartIngredient.objects.all()
+        if user_ids is not None:
+            stored_rows = stored_rows.filter(user_id__in=user_ids)
+        stored = {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount in stored_rows.values_list(
+                'user_id', 'ingredient_id', 'amount')
+        }
+        mismatches = [
+            (key, stored.get(key), expected.get(key))
+            for key in sorted(stored.keys() | expected.keys())
+            if stored.get(key) != expected.get(key)
+        ]
+        for (user_id, ingredient_id), stored_amount, amount in mismatches:
+            self.stdout.write(
+                f'Пользователь {user_id}, ингредиент {ingredient_id}: '
+                f'сохранено {stored_amount}, ожидается {amount}'
+            )
+        if mismatches:
+            raise CommandError(
+                f'Найдено расхождений: {len(mismatches)}. '
+                'Запустите команду без --check для пересчета.'
+            )
+        self.stdout.write(self.style.SUCCESS('Расхождений не найдено'))
@@ -0,0 +1,37 @@
+from django.core.management import BaseCommand, CommandError
+from recipes.counters import COUNTERS, get_drift, reconcile_counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчет счетчиков избранного, корзин, рецептов и подписчиков'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только сверить счетчики с данными',
+        )
+
+    def handle(self, *args, check=False, **kwargs):
+        if not check:
+            fixed = reconcile_counters()
+            for name, count in fixed.items():
+                self.stdout.write(f'{name}: исправлено записей {count}')
+            self.stdout.write(self.style.SUCCESS('Счетчики пересчитаны'))
+            return
+        mismatches = 0
+        for model, counter, source, field_name in COUNTERS:
+            drift = get_drift(model, counter, source, field_name)
+            for pk, stored, actual in drift.values_list(
+                    'pk', counter, 'actual'):
+                self.stdout.write(
+                    f'{model._meta.model_name} {pk}, {counter}: '
+                    f'сохранено {stored}, ожидается {actual}'
+                )
+                mismatches += 1
+        if mismatches:
+            raise CommandError(
+                f'Найдено расхождений: {mismatches}. '
+                'Запустите команду без --check для пересчета.'
+            )
+        self.stdout.write(self.style.SUCCESS('Расхождений не найдено'))
@@ -0,0 +1,74 @@
+from benchmarks.suite import BenchmarkSeeder
+from django.core.management import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        'Генерация пользователей, рецептов, избранного, корзин и подписок '
+        'для нагрузочных тестов (benchmark_api)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=1000,
+            help='Количество пользователей',
+        )
+        parser.add_argument(
+            '--recipes',
+            type=int,
+            default=5000,
+            help='Количество рецептов',
+        )
+        parser.add_argument(
+            '--favorites',
+            type=float,
+            default=10,
+            help='Среднее число рецептов в избранном пользователя',
+        )
+        parser.add_argument(
+            '--cart-share',
+            type=float,
+            default=0.3,
+            help='Доля пользователей с непустой корзиной',
+        )
+        parser.add_argument(
+            '--cart',
+            type=float,
+            default=4,
+            help='Среднее число рецептов в непустой корзине',
+        )
+        parser.add_argument(
+            '--subscriptions',
+            type=float,
+            default=5,
+            help='Среднее число подписок пользователя',
+        )
+        parser.add_argument(
+            '--prefix',
+            default='bench',
+            help='Префикс имен создаваемых пользователей и рецептов',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Начальное значение генератора случайных чисел',
+        )
+
+    def handle(self, *args, prefix='bench', seed=0, **options):
+        seeder = BenchmarkSeeder(prefix=prefix, seed=seed)
+        try:
+            counts = seeder.run(
+                users=options['users'],
+                recipes=options['recipes'],
+                favorites=options['favorites'],
+                cart_share=options['cart_share'],
+                cart=options['cart'],
+                subscriptions=options['subscriptions'],
+            )
+        except ValueError as error:
+            raise CommandError(error)
+        self.stdout.write(self.style.SUCCESS(', '.join(
+            f'{name}: {count}' for name, count in counts.items())))
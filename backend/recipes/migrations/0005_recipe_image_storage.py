@@ -0,0 +1,19 @@
+# Generated by Django 3.2.16 on 2026-10-17 04:27
+
+from django.db import migrations, models
+import recipes.images
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_shoppingcartingredient'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(storage=recipes.images.ContentHashStorage(), upload_to='recipes/images/', verbose_name='Картинка'),
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 3.2.16 on 2026-10-17 05:40
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    """
+    Сводит повторяющиеся ингредиенты к записи с наименьшим id.
+
+    Ссылки из рецептов и агрегатов корзин переносятся на оставшуюся
+    запись; если рецепт или корзина ссылались на несколько дублей,
+    количества складываются.
+    """
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    ShoppingCartIngredient = apps.get_model(
+        'recipes', 'ShoppingCartIngredient')
+    canonical_ids = {
+        (name, measurement_unit): ingredient_id
+        for name, measurement_unit, ingredient_id in Ingredient.objects.values(
+            'name', 'measurement_unit'
+        ).annotate(ingredient_id=Min('id')).values_list(
+            'name', 'measurement_unit', 'ingredient_id')
+    }
+    replacements = {
+        ingredient_id: canonical_ids[(name, measurement_unit)]
+        for ingredient_id, name, measurement_unit
+        in Ingredient.objects.exclude(
+            id__in=canonical_ids.values()
+        ).values_list('id', 'name', 'measurement_unit')
+    }
+    if not replacements:
+        return
+    for model, owner_field, ingredient_field in (
+            (RecipeIngredient, 'recipe_id', 'ingredients_id'),
+            (ShoppingCartIngredient, 'user_id', 'ingredient_id')):
+        rows = list(model.objects.filter(**{
+            f'{ingredient_field}__in':
+                list(replacements) + list(set(replacements.values()))
+        }).order_by('id'))
+        kept = {
+            (getattr(row, owner_field), getattr(row, ingredient_field)): row
+            for row in rows
+            if getattr(row, ingredient_field) not in replacements
+        }
+        for row in rows:
+            ingredient_id = getattr(row, ingredient_field)
+            if ingredient_id not in replacements:
+                continue
+            key = (getattr(row, owner_field), replacements[ingredient_id])
+            if key in kept:
+                kept[key].amount += row.amount
+                kept[key].save(update_fields=('amount',))
+                row.delete()
+            else:
+                setattr(row, ingredient_field, key[1])
+                row.save(update_fields=(ingredient_field,))
+                kept[key] = row
+    Ingredient.objects.filter(id__in=replacements).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_recipe_pub_date'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_ingredients, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient'),
+        ),
+    ]
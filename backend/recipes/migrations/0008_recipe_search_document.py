@@ -0,0 +1,67 @@
+# Generated by Django 3.2.16 on 2026-10-17 06:05
+
+from django.db import migrations, models
+
+SEARCH_INDEX = 'recipe_search_document_idx'
+FTS_TABLE = 'recipes_recipe_fts'
+
+
+def fill_search_documents(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    recipes = list(Recipe.objects.prefetch_related(
+        'recipe_ingredients__ingredients'))
+    for recipe in recipes:
+        recipe.search_document = '\n'.join((
+            recipe.name,
+            recipe.text,
+            ' '.join(
+                recipe_ingredient.ingredients.name
+                for recipe_ingredient in recipe.recipe_ingredients.all()
+            ),
+        ))
+    Recipe.objects.bulk_update(
+        recipes, ('search_document',), batch_size=1000)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            f'CREATE INDEX {SEARCH_INDEX} ON recipes_recipe '
+            "USING GIN (to_tsvector('russian'::regconfig, search_document))"
+        )
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE {FTS_TABLE} '
+            'USING fts5(search_document, tokenize=unicode61)'
+        )
+        schema_editor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, search_document) '
+            'SELECT id, search_document FROM recipes_recipe'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {SEARCH_INDEX}')
+    elif vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_ingredient_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_document',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='Поисковый документ'),
+        ),
+        migrations.RunPython(
+            fill_search_documents, migrations.RunPython.noop),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 3.2.16 on 2026-10-17 04:46
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+COUNTERS = (
+    ('recipes', 'Recipe', 'favorites_count', 'recipes', 'Favorite', 'recipe'),
+    ('recipes', 'Recipe', 'cart_count', 'recipes', 'ShoppingCart', 'recipe'),
+    ('users', 'User', 'recipes_count', 'recipes', 'Recipe', 'author'),
+    ('users', 'User', 'followers_count', 'users', 'Subscription', 'following'),
+)
+
+
+def fill_counters(apps, schema_editor):
+    for app, model, counter, source_app, source, field_name in COUNTERS:
+        source = apps.get_model(source_app, source)
+        apps.get_model(app, model).objects.update(**{counter: Coalesce(
+            Subquery(
+                source.objects.filter(
+                    **{field_name: OuterRef('pk')}
+                ).order_by().values(field_name).annotate(
+                    count=Count('pk')).values('count')
+            ), 0)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_recipe_tags_tag_recipe_index'),
+        ('users', '0007_user_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='cart_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В корзинах покупок'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-favorites_count', '-pub_date', '-id'], name='recipe_favorites_count_idx'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,10 @@
 from django.core.validators import MinValueValidator
-from django.db import models
-from django.db.models import UniqueConstraint
+from django.db import models, transaction
+from django.db.models import Sum, UniqueConstraint
 from users.models import User
 
+from .images import ContentHashStorage
+
 MAX_LENGTH = 200
 MAX_COLOR_LENGTH = 7
 
@@ -50,6 +52,10 @@ class Ingredient(models.Model):
     class Meta:
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'ингредиенты'
+        constraints = (
+            models.UniqueConstraint(fields=('name', 'measurement_unit'),
+                                    name='unique_ingredient'),
+        )
 
     def __str__(self) -> str:
         return self.name
@@ -64,7 +70,8 @@ class Recipe(models.Model):
     )
     image = models.ImageField(
         verbose_name='Картинка',
-        upload_to='recipes/images/',)
+        upload_to='recipes/images/',
+        storage=ContentHashStorage(),)
     text = models.TextField(
         verbose_name='Описание',
     )
@@ -92,8 +99,40 @@ class Recipe(models.Model):
         related_name='recipes',
         verbose_name='Автор',
     )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации',
+        auto_now_add=True,
+    )
+    updated_at = models.DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True,
+    )
+    search_document = models.TextField(
+        verbose_name='Поисковый документ',
+        blank=True,
+        default='',
+        editable=False,
+    )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном',
+        default=0,
+        editable=False,
+    )
+    cart_count = models.PositiveIntegerField(
+        verbose_name='В корзинах покупок',
+        default=0,
+        editable=False,
+    )
 
     class Meta:
+        ordering = ('-pub_date', '-id')
+        indexes = (
+            models.Index(
+                fields=('-pub_date', '-id'), name='recipe_pub_date_id_idx'),
+            models.Index(
+                fields=('-favorites_count', '-pub_date', '-id'),
+                name='recipe_favorites_count_idx'),
+        )
         verbose_name = 'Рецепт'
         verbose_name_plural = 'рецепты'
 
@@ -191,3 +230,173 @@ class RecipeIngredient(models.Model):
             f'{self.ingredients.name} '
             f'({self.ingredients.measurement_unit}) - {self.amount}'
         )
+
+
+class ShoppingCartIngredientManager(models.Manager):
+    """
+    Менеджер суммарных количеств ингредиентов в корзинах покупок.
+
+    Агрегат обновляется приращениями: при добавлении рецепта в корзину,
+    удалении из нее и изменении ингредиентов рецепта, лежащего в корзинах.
+    """
+
+    def apply_deltas(self, user_ids, deltas):
+        """Изменяет количества ингредиентов в корзинах пользователей."""
+        deltas = {
+            ingredient_id: delta
+            for ingredient_id, delta in deltas.items() if delta
+        }
+        if not user_ids or not deltas:
+            return
+        with transaction.atomic():
+            existing = {
+                (row.user_id, row.ingredient_id): row
+                for row in self.select_for_update().filter(
+                    user_id__in=user_ids, ingredient_id__in=deltas)
+            }
+            to_create, to_update, to_delete = [], [], []
+            for user_id in user_ids:
+                for ingredient_id, delta in deltas.items():
+                    row = existing.get((user_id, ingredient_id))
+                    if row is None:
+                        if delta > 0:
+                            to_create.append(self.model(
+                                user_id=user_id,
+                                ingredient_id=ingredient_id,
+                                amount=delta,
+                            ))
+                        continue
+                    row.amount += delta
+                    if row.amount > 0:
+                        to_update.append(row)
+                    else:
+                        to_delete.append(row.id)
+            self.bulk_create(to_create)
+            self.bulk_update(to_update, ('amount',))
+            self.filter(id__in=to_delete).delete()
+
+    def get_recipe_amounts(self, recipe_ids):
+        """Возвращает суммарные количества ингредиентов рецептов."""
+        return dict(RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('ingredients_id').annotate(
+            total=Sum('amount')).order_by())
+
+    def add_recipe(self, user, recipe_id):
+        self.add_recipes(user, (recipe_id,))
+
+    def add_recipes(self, user, recipe_ids):
+        self.apply_deltas((user.id,), self.get_recipe_amounts(recipe_ids))
+
+    def remove_recipe(self, user, recipe_id):
+        self.remove_recipes(user, (recipe_id,))
+
+    def remove_recipes(self, user, recipe_ids):
+        amounts = self.get_recipe_amounts(recipe_ids)
+        self.apply_deltas(
+            (user.id,),
+            {ingredient_id: -amount
+             for ingredient_id, amount in amounts.items()}
+        )
+
+    def remove_recipe_from_all(self, recipe_id):
+        """Убирает рецепт из агрегатов всех корзин, где он лежит."""
+        amounts = self.get_recipe_amounts((recipe_id,))
+        self.apply_deltas(
+            self.get_cart_user_ids(recipe_id),
+            {ingredient_id: -amount
+             for ingredient_id, amount in amounts.items()}
+        )
+
+    def update_recipe(self, recipe_id, old_amounts, new_amounts):
+        """Переносит изменение ингредиентов рецепта во все корзины."""
+        deltas = {
+            ingredient_id: (
+                new_amounts.get(ingredient_id, 0)
+                - old_amounts.get(ingredient_id, 0)
+            )
+            for ingredient_id in old_amounts.keys() | new_amounts.keys()
+        }
+        self.apply_deltas(self.get_cart_user_ids(recipe_id), deltas)
+
+    def get_cart_user_ids(self, recipe_id):
+        return list(ShoppingCart.objects.filter(
+            recipe_id=recipe_id).values_list('user_id', flat=True))
+
+    def calculate(self, user_ids=None):
+        """
+        Пересчитывает агрегат по содержимому корзин.
+
+        Возвращает словарь {(user_id, ingredient_id): amount}.
+        """
+        if user_ids is None:
+            recipe_ingredients = RecipeIngredient.objects.filter(
+                recipe__shopping_cart__isnull=False)
+        else:
+            recipe_ingredients = RecipeIngredient.objects.filter(
+                recipe__shopping_cart__user_id__in=user_ids)
+        rows = recipe_ingredients.values_list(
+            'recipe__shopping_cart__user_id', 'ingredients_id'
+        ).annotate(total=Sum('amount')).order_by()
+        return {
+            (user_id, ingredient_id): total
+            for user_id, ingredient_id, total in rows
+        }
+
+    def rebuild(self, user_ids=None, batch_size=1000):
+        """Полностью перестраивает агрегат по содержимому корзин."""
+        amounts = self.calculate(user_ids)
+        with transaction.atomic():
+            stored = self.all()
+            if user_ids is not None:
+                stored = stored.filter(user_id__in=user_ids)
+            stored.delete()
+            self.bulk_create(
+                (
+                    self.model(
+                        user_id=user_id,
+                        ingredient_id=ingredient_id,
+                        amount=amount,
+                    )
+                    for (user_id, ingredient_id), amount in amounts.items()
+                ),
+                batch_size=batch_size,
+            )
+        return len(amounts)
+
+
+class ShoppingCartIngredient(models.Model):
+    """Модель суммарного количества ингредиента в корзине покупок."""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_cart_ingredients',
+        verbose_name='Пользователь',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_cart_ingredients',
+        verbose_name='Ингредиент',
+    )
+    amount = models.PositiveIntegerField(
+        verbose_name='Количество',
+    )
+
+    objects = ShoppingCartIngredientManager()
+
+    class Meta:
+        verbose_name = 'Ингредиент в корзине покупок'
+        verbose_name_plural = 'ингредиенты в корзине покупок'
+        constraints = (
+            UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='unique_shopping_cart_ingredient'),
+        )
+
+    def __str__(self):
+        return (
+            f'{self.ingredient.name} '
+            f'({self.ingredient.measurement_unit}) - {self.amount}'
+        )
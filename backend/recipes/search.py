@@ -0,0 +1,160 @@
+"""
+Полнотекстовый поиск рецептов.
+
+У каждого рецепта хранится поисковый документ: название, описание и
+названия ингредиентов. На PostgreSQL по документу построен GIN-индекс
+to_tsvector, на SQLite документ дублируется в таблицу FTS5
+recipes_recipe_fts с rowid, равным id рецепта. Документы обновляются
+сигналами после фиксации транзакции.
+"""
+import re
+
+from django.db import connection
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+
+from .models import Recipe
+
+SEARCH_CONFIG = 'russian'
+FTS_TABLE = 'recipes_recipe_fts'
+SNIPPET_START = '<mark>'
+SNIPPET_STOP = '</mark>'
+SNIPPET_WORDS = 16
+WORD_RE = re.compile(r'\w+')
+
+POSTGRES_VECTOR = (
+    f"to_tsvector('{SEARCH_CONFIG}'::regconfig, "
+    '"recipes_recipe"."search_document")'
+)
+POSTGRES_QUERY = f"websearch_to_tsquery('{SEARCH_CONFIG}'::regconfig, %s)"
+
+
+def build_search_document(recipe):
+    ingredient_names = ' '.join(
+        recipe_ingredient.ingredients.name
+        for recipe_ingredient in recipe.recipe_ingredients.all()
+    )
+    return '\n'.join((recipe.name, recipe.text, ingredient_names))
+
+
+def update_search_documents(recipe_ids):
+    """Пересчитывает поисковые документы рецептов с указанными id."""
+    recipes = list(Recipe.objects.filter(id__in=recipe_ids).only(
+        'id', 'name', 'text', 'search_document'
+    ).prefetch_related('recipe_ingredients__ingredients'))
+    changed = []
+    for recipe in recipes:
+        document = build_search_document(recipe)
+        if document != recipe.search_document:
+            recipe.search_document = document
+            changed.append(recipe)
+    Recipe.objects.bulk_update(changed, ('search_document',))
+    if connection.vendor == 'sqlite' and changed:
+        delete_fts_rows([recipe.id for recipe in changed])
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, search_document) '
+                'VALUES (%s, %s)',
+                [(recipe.id, recipe.search_document) for recipe in changed],
+            )
+
+
+def delete_fts_rows(recipe_ids):
+    if connection.vendor != 'sqlite' or not recipe_ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {FTS_TABLE} WHERE rowid IN '
+            f'({", ".join(["%s"] * len(recipe_ids))})',
+            list(recipe_ids),
+        )
+
+
+def get_fts_query(query):
+    """
+    Переводит пользовательский запрос в запрос FTS5.
+
+    Каждое слово берется в кавычки и ищется по префиксу, поэтому
+    операторы FTS5 во вводе пользователя не интерпретируются.
+    """
+    return ' '.join(f'"{word}"*' for word in WORD_RE.findall(query))
+
+
+def search(queryset, query):
+    """
+    Фильтрует рецепты по поисковому запросу.
+
+    Рецепты сортируются по релевантности (аннотация search_rank, больше
+    значит релевантнее), при равенстве - по стандартной сортировке.
+    """
+    ordering = ('-search_rank', *queryset.model._meta.ordering)
+    if connection.vendor == 'postgresql':
+        return queryset.annotate(search_rank=RawSQL(
+            f'ts_rank_cd({POSTGRES_VECTOR}, {POSTGRES_QUERY})',
+            (query,), output_field=FloatField(),
+        )).extra(
+            where=[f'{POSTGRES_VECTOR} @@ {POSTGRES_QUERY}'], params=[query],
+        ).order_by(*ordering)
+    if connection.vendor == 'sqlite':
+        fts_query = get_fts_query(query)
+        if not fts_query:
+            return queryset.none()
+        return queryset.annotate(search_rank=RawSQL(
+            f'SELECT -bm25({FTS_TABLE}) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s '
+            f'AND {FTS_TABLE}.rowid = "recipes_recipe"."id"',
+            (fts_query,), output_field=FloatField(),
+        )).extra(
+            where=[
+                f'"recipes_recipe"."id" IN (SELECT rowid FROM {FTS_TABLE} '
+                f'WHERE {FTS_TABLE} MATCH %s)'
+            ],
+            params=[fts_query],
+        ).order_by(*ordering)
+    words = WORD_RE.findall(query)
+    for word in words:
+        queryset = queryset.filter(search_document__icontains=word)
+    return queryset.annotate(search_rank=RawSQL(
+        '1', (), output_field=FloatField())).order_by(*ordering)
+
+
+def get_snippets(recipe_ids, query):
+    """
+    Возвращает фрагменты документов с подсвеченными совпадениями.
+
+    Фрагменты строятся одним запросом только для переданных рецептов
+    (обычно текущей страницы): на PostgreSQL ts_headline дорог.
+    """
+    if not recipe_ids:
+        return {}
+    placeholders = ', '.join(['%s'] * len(recipe_ids))
+    if connection.vendor == 'postgresql':
+        sql = (
+            f"SELECT id, ts_headline('{SEARCH_CONFIG}'::regconfig, "
+            f'search_document, {POSTGRES_QUERY}, %s) '
+            f'FROM recipes_recipe WHERE id IN ({placeholders})'
+        )
+        params = [
+            query,
+            f'StartSel={SNIPPET_START}, StopSel={SNIPPET_STOP}, '
+            f'MaxWords={SNIPPET_WORDS}, MinWords={SNIPPET_WORDS // 2}',
+            *recipe_ids,
+        ]
+    elif connection.vendor == 'sqlite':
+        fts_query = get_fts_query(query)
+        if not fts_query:
+            return {}
+        sql = (
+            f"SELECT rowid, snippet({FTS_TABLE}, 0, %s, %s, '…', %s) "
+            f'FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+            f'AND rowid IN ({placeholders})'
+        )
+        params = [
+            SNIPPET_START, SNIPPET_STOP, SNIPPET_WORDS, fts_query,
+            *recipe_ids,
+        ]
+    else:
+        return {}
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return dict(cursor.fetchall())
@@ -0,0 +1,39 @@
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from recipes.models import Ingredient
+
+
+class ImportIngredientsTest(TestCase):
+    """Повторный импорт ингредиентов не создает дублей."""
+
+    def import_csv(self, content, batch_size=2):
+        file = tempfile.NamedTemporaryFile(
+            'w', suffix='.csv', encoding='utf-8', delete=False)
+        self.addCleanup(os.remove, file.name)
+        with file:
+            file.write(content)
+        output = StringIO()
+        call_command(
+            'import_ingredients', file.name, batch_size=batch_size,
+            stdout=output)
+        return output.getvalue()
+
+    def test_counts(self):
+        Ingredient.objects.create(name='соль', measurement_unit='г')
+        output = self.import_csv(
+            'name,measurement_unit\n'
+            'соль,г\n'
+            'сахар,г\n'
+            'сахар,г\n'
+            'молоко,мл\n'
+            ',г\n'
+        )
+        self.assertIn('Добавлено: 2, пропущено: 3', output)
+        self.assertEqual(Ingredient.objects.count(), 3)
+        output = self.import_csv('name,measurement_unit\nсахар,г\nмолоко,мл\n')
+        self.assertIn('Добавлено: 0, пропущено: 2', output)
+        self.assertEqual(Ingredient.objects.count(), 3)
@@ -13,6 +13,8 @@ class UserAdmin(UserAdmin):
         'email',
         'first_name',
         'last_name',
+        'recipes_count',
+        'followers_count',
     )
     list_filter = ('email', 'username')
     search_fields = ('username', 'email', 'first_name', 'last_name',)
@@ -28,8 +28,23 @@ class User(AbstractUser):
         verbose_name='Фамилия',
         max_length=MAX_FIELD_LENGTH,
     )
+    recipes_count = models.PositiveIntegerField(
+        verbose_name='Количество рецептов',
+        default=0,
+        editable=False,
+    )
+    followers_count = models.PositiveIntegerField(
+        verbose_name='Количество подписчиков',
+        default=0,
+        editable=False,
+    )
 
     class Meta:
+        indexes = (
+            models.Index(
+                fields=('-date_joined', '-id'),
+                name='user_date_joined_id_idx'),
+        )
         verbose_name = 'Пользователь'
         verbose_name_plural = 'пользователи'
 